@@ -0,0 +1,110 @@
+"""
+Watch events received per driver pod as the fleet grows, with
+the watches clusterwide or scoped to the pod's namespace. Each
+"pod" is an operator watching one bench room the way the driver
+does (digi.main.run); every room in the fleet is updated once
+and the events delivered to each operator are counted, before
+the per-model `when` filter drops them.
+
+Requires the bench room CRD (kubectl apply -f digis/room/crd.yaml);
+the rooms are created in the namespaces bench-fanout-{i}.
+"""
+
+import os
+import time
+import random
+import logging
+import pprint as pp
+from collections import Counter
+
+import kopf
+import kubernetes
+import digi.util as util
+
+room_gvr = ("bench.digi.dev", "v1", "rooms")
+FLEET = (2, 4, 8, 16)
+
+
+def _ns(i):
+    return f"bench-fanout-{i}"
+
+
+def setup(n):
+    core = kubernetes.client.CoreV1Api()
+    api = kubernetes.client.CustomObjectsApi()
+    for i in range(n):
+        try:
+            core.create_namespace({"metadata": {"name": _ns(i)}})
+        except kubernetes.client.rest.ApiException:
+            pass
+        try:
+            api.create_namespaced_custom_object(*room_gvr[:2], _ns(i),
+                                                room_gvr[2], {
+                "apiVersion": "bench.digi.dev/v1",
+                "kind": "Room",
+                "metadata": {"name": "room"},
+                "spec": {"control": {"brightness": {"intent": 0}}},
+            })
+        except kubernetes.client.rest.ApiException:
+            pass
+
+
+def teardown(n):
+    core = kubernetes.client.CoreV1Api()
+    for i in range(n):
+        try:
+            core.delete_namespace(_ns(i))
+        except kubernetes.client.rest.ApiException:
+            pass
+
+
+def start_pod(i, received: Counter):
+    _registry = util.KopfRegistry()
+
+    # count every delivered event, i.e., no `when` filter
+    @kopf.on.event(*room_gvr, registry=_registry)
+    def on_event(**_):
+        received[i] += 1
+
+    return util.run_operator(_registry, log_level=logging.WARNING,
+                             namespaces=[_ns(i)])
+
+
+def benchmark_fanout(n, clusterwide):
+    os.environ["CLUSTERWIDE"] = "true" if clusterwide else "false"
+    received = Counter()
+    flags = [start_pod(i, received) for i in range(n)]
+    for ready, _ in flags:
+        ready.wait()
+    time.sleep(2)
+    # skip the initial listing
+    received.clear()
+
+    for i in range(n):
+        util.patch_spec(*room_gvr, "room", _ns(i), {
+            "control": {
+                "brightness": {
+                    "intent": random.randint(1, 100000000)
+                }
+            }
+        })
+    time.sleep(2)
+
+    for _, stop in flags:
+        stop.set()
+    return sum(received.values()) / n
+
+
+if __name__ == '__main__':
+    setup(max(FLEET))
+    time.sleep(1)
+
+    try:
+        pp.pprint({
+            n: {
+                "clusterwide": benchmark_fanout(n, clusterwide=True),
+                "namespaced": benchmark_fanout(n, clusterwide=False),
+            } for n in FLEET
+        })
+    finally:
+        teardown(max(FLEET))
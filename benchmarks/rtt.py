@@ -0,0 +1,79 @@
+"""
+Round trips to the apiserver per propagation hop, i.e., per
+conditional write (util.check_gen_and_patch_spec) issued by
+the reconciler and the mounter, with and without the watch-fed
+model cache.
+
+Requires the bench room model (make graph or kubectl apply -f
+digis/room/test/cr.yaml).
+"""
+
+import time
+import random
+import logging
+import pprint as pp
+
+import kopf
+import digi.util as util
+
+room_gvr = ("bench.digi.dev", "v1", "rooms", "room-test", "default")
+K = 50
+
+
+def _hop(gen):
+    return util.check_gen_and_patch_spec(*room_gvr, {
+        "control": {
+            "brightness": {
+                "intent": random.randint(1, 100000000)
+            }
+        }
+    }, gen=gen)
+
+
+def benchmark_hops(use_cache=True, k=K):
+    util.api_calls.clear()
+    gen = util.get_spec(*room_gvr)[2]
+
+    start = time.time()
+    for _ in range(k):
+        if not use_cache:
+            # without the cache every write GETs the model first
+            util.cache.invalidate(util.model_id(*room_gvr))
+        _, resp, e = _hop(gen)
+        if e is not None:
+            print(f"bench: encountered error {e}")
+            exit()
+        gen = resp["metadata"]["generation"]
+    elapsed = time.time() - start
+
+    return {
+        "round_trips_per_hop": sum(util.api_calls.values()) / k,
+        "gets_per_hop": util.api_calls["get"] / k,
+        "latency_per_hop": elapsed / k,
+    }
+
+
+def start_watch():
+    # feed the cache from a watch as the driver does
+    _, _, _, n, ns = room_gvr
+    _registry = util.KopfRegistry()
+    _kwargs = {
+        "registry": _registry,
+        "when": lambda name, namespace, **_: name == n and namespace == ns,
+    }
+    kopf.on.event(*room_gvr[:3], **_kwargs)(util.cache_event_fn(*room_gvr))
+    return util.run_operator(_registry, log_level=logging.WARNING)
+
+
+if __name__ == '__main__':
+    _, stop = start_watch()
+    time.sleep(2)
+
+    # warm-up
+    benchmark_hops(k=5)
+
+    pp.pprint({
+        "no_cache": benchmark_hops(use_cache=False),
+        "cache": benchmark_hops(use_cache=True),
+    })
+    stop.set()
@@ -93,7 +93,7 @@ def default(sv, mounts):
     # if no mounted devices, set the
     # status to intent
     if util.mount_size(mounts) == 0:
-        for _, v in sv.items():
+        for _, v in sv.get("control", {}).items():
             if "intent" in v:
                 v["status"] = v["intent"]
 
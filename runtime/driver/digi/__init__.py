@@ -34,6 +34,8 @@ from digi import (
     view,
     filter,
     mount,
+    metrics,
+    client,
 )
 from digi.main import run
 from digi.reconcile import rc
@@ -41,5 +43,6 @@ auri = (rc.g, rc.v, rc.r, rc.n, rc.ns)
 
 __all__ = [
     "on", "util", "view", "filter",
-    "run", "logger", "auri", "mount"
+    "run", "logger", "auri", "mount", "metrics",
+    "client",
 ]
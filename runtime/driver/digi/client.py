@@ -0,0 +1,185 @@
+"""Pooled asyncio client of the apiserver."""
+
+import os
+import ssl
+import json
+import asyncio
+import threading
+
+import aiohttp
+import kubernetes
+from kubernetes.client.rest import ApiException
+
+from digi import logger
+import digi.metrics as metrics
+
+# when enabled, util.get_spec and util.patch_spec (and so the
+# reconciler and the mounter) go through the shared client
+enabled = os.environ.get("ASYNC_CLIENT", "false") == "true"
+# max connections kept in the pool
+pool_size = int(os.environ.get("CLIENT_POOL_SIZE", 16))
+# max concurrent requests per target model
+per_model = int(os.environ.get("CLIENT_PER_MODEL", 2))
+
+
+class Client:
+    """
+    Client of the namespaced custom objects on its own loop
+    thread, with a pool of keep-alive connections shared by
+    the reconciler, the mounter and the drivers. The async
+    methods (get, patch) can be awaited on any loop, e.g., by
+    the async handlers on the operator's, and are run on the
+    client's loop; the sync facade (get_sync, patch_sync)
+    blocks the calling thread and must not be called on the
+    client's loop.
+
+    Requests to the same model are limited to per_model at a
+    time; the connection reuse is counted in the metrics.
+    """
+
+    def __init__(self, pool_size_: int = None, per_model_: int = None):
+        self._pool_size = pool_size if pool_size_ is None else pool_size_
+        self._per_model = per_model if per_model_ is None else per_model_
+
+        self._loop = None
+        self._lock = threading.Lock()
+        self._session = None
+        self._host = None
+        # semaphores of the models with requests in flight and
+        # the number of the requests, keyed by the model id; an
+        # idle model's semaphore is dropped
+        self._sems = dict()
+
+    async def get(self, g, v, r, n, ns) -> dict:
+        return await self.run_async(self._request("GET", g, v, r, n, ns))
+
+    async def patch(self, g, v, r, n, ns, body: dict) -> dict:
+        return await self.run_async(self._request("PATCH", g, v, r, n, ns,
+                                                  body))
+
+    def get_sync(self, g, v, r, n, ns) -> dict:
+        return self.run(self._request("GET", g, v, r, n, ns))
+
+    def patch_sync(self, g, v, r, n, ns, body: dict) -> dict:
+        return self.run(self._request("PATCH", g, v, r, n, ns, body))
+
+    def run(self, coro):
+        """Run the coroutine on the client's loop and wait."""
+        loop = self._start()
+        assert asyncio._get_running_loop() is not loop, \
+            "sync facade called on the client's loop"
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def run_async(self, coro):
+        """Run the coroutine on the client's loop and await it
+        on the caller's, s.t. the session and the semaphores
+        are only used on the client's loop."""
+        loop = self._start()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._session is not None:
+            self.run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop, self._session = None, None
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever,
+                                 daemon=True).start()
+            return self._loop
+
+    async def _request(self, method, g, v, r, n, ns, body=None) -> dict:
+        _id = f"{g}/{v}/{r}/{ns}/{n}"
+        # on the client's loop only, so no lock is needed
+        entry = self._sems.get(_id, None)
+        if entry is None:
+            entry = self._sems[_id] = [asyncio.Semaphore(self._per_model), 0]
+        entry[1] += 1
+        try:
+            return await self._send(entry[0], method, g, v, r, n, ns, body)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._sems.pop(_id, None)
+
+    async def _send(self, sem, method, g, v, r, n, ns, body) -> dict:
+        session = self._get_session()
+
+        url = f"{self._host}/apis/{g}/{v}/namespaces/{ns}/{r}/{n}"
+        headers = {"Content-Type": "application/merge-patch+json"} \
+            if method == "PATCH" else None
+        async with sem:
+            async with session.request(method, url, json=body,
+                                       headers=headers) as resp:
+                text = await resp.text()
+                if resp.status >= 400:
+                    e = ApiException(status=resp.status, reason=resp.reason)
+                    e.body = text
+                    raise e
+                try:
+                    return json.loads(text)
+                except ValueError:
+                    e = ApiException(status=resp.status,
+                                     reason="Invalid JSON in the response")
+                    e.body = text
+                    raise e
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created on the client's loop
+        if self._session is not None:
+            return self._session
+
+        conf = kubernetes.client.Configuration.get_default_copy()
+        self._host = conf.host.rstrip("/")
+
+        headers = dict()
+        token = conf.api_key.get("authorization", None) or \
+                conf.api_key.get("BearerToken", None)
+        if token is not None:
+            prefix = conf.api_key_prefix.get("authorization", None)
+            headers["Authorization"] = token if prefix is None \
+                else f"{prefix} {token}"
+
+        ssl_ctx = False
+        if conf.verify_ssl and self._host.startswith("https"):
+            ssl_ctx = ssl.create_default_context(cafile=conf.ssl_ca_cert)
+            if conf.cert_file is not None:
+                ssl_ctx.load_cert_chain(conf.cert_file, conf.key_file)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(_on_connection_create)
+        trace.on_connection_reuseconn.append(_on_connection_reuse)
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._pool_size,
+                                           ssl=ssl_ctx),
+            headers=headers,
+            trace_configs=[trace],
+        )
+        logger.info(f"client: pooled connections to {self._host} "
+                    f"(pool size {self._pool_size}, "
+                    f"{self._per_model} per model)")
+        return self._session
+
+
+async def _on_connection_create(*args):
+    _ = args
+    if metrics.enabled:
+        metrics.inc("client_connections_created")
+
+
+async def _on_connection_reuse(*args):
+    _ = args
+    if metrics.enabled:
+        metrics.inc("client_connections_reused")
+
+
+client = Client()
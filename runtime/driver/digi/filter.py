@@ -6,34 +6,166 @@ def always(*args, **kwargs):
     return True
 
 
-def has_diff(_, diff, path, *args, **kwargs) -> bool:
+def has_diff(_, diff, path, *args, diff_index=None, **kwargs) -> bool:
     _, _ = args, kwargs
-    changed_paths = {(".",): True}
-    # TBD: add shared diff for all handlers
     # TBD: support incremental diff
+    if diff_index is None:
+        diff_index = DiffIndex(diff)
+    return diff_index.has(path)
 
-    for op, path_, old, new in diff:
-        # on create
-        if old is None and len(path_) == 0:
-            changed_paths.update(_from_model(new))
-        else:
-            changed_paths.update(_from_path_tuple(path_))
 
-    if path in changed_paths or len(diff) == 0:
-        return True
-    return False
+class DiffIndex:
+    """
+    Index of the diff of an event, built once and shared
+    by the conditions and handlers:
+    - paths: the changed paths (with "spec" skipped) and
+      their prefixes, i.e., the changed subtrees;
+    - created: the spec of a created/resumed model, whose
+      paths are looked up on demand instead of expanded;
+    - back_prop: the intent/input changes on the mounts;
+    - reflex_changed: whether the reflexes are changed.
+    """
 
+    def __init__(self, diff):
+        self.diff = diff
+        self.paths = set()
+        self.created = None
+        self.back_prop = list()
+        self.reflex_changed = False
 
-def _from_model(d: dict):
-    result = dict()
-    to_visit = [[d.get("spec", {}), []]]
-    for n, prefix in to_visit:
-        result[tuple(prefix)] = True
-        if type(n) is not dict:
+        for op, path, old, new in diff:
+            # on create
+            if old is None and len(path) == 0:
+                self.created = new.get("spec", {})
+                if type(self.created) is dict and \
+                        "reflex" in self.created:
+                    self.reflex_changed = True
+                continue
+
+            self.paths.update(_from_path_tuple(path))
+            if len(path) >= 2 and path[1] == "reflex":
+                self.reflex_changed = True
+            if is_back_prop(op, path):
+                self.back_prop.append((op, path, old, new))
+
+    def has(self, path: tuple) -> bool:
+        if path == (".",) or len(self.diff) == 0:
+            return True
+        if path in self.paths:
+            return True
+        return self.created is not None and \
+               _has_path(self.created, path)
+
+
+def is_back_prop(op, path: tuple) -> bool:
+    # intent or input changes on a child's copy
+    if op != "change" and op != "add":
+        return False
+    if len(path) < 3 or path[0] != "spec" \
+            or path[1] != "mount":
+        return False
+    fs = set(path)
+    return "intent" in fs or "input" in fs
+
+
+def _has_path(d, path: tuple) -> bool:
+    for k in path:
+        if type(d) is not dict or k not in d:
+            return False
+        d = d[k]
+    return True
+
+
+class PathTrie:
+    """
+    Trie of the view paths subscribed by the handlers; each
+    node holds the keys of handlers subscribed to the path
+    from the root to the node. Matching walks the diff once
+    instead of expanding it for every handler, with the same
+    semantics as has_diff.
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        # handlers subscribed to the whole model (".",)
+        self._wildcard = set()
+        self._keys = set()
+
+    def add(self, path: tuple, key):
+        self._keys.add(key)
+        if path == (".",):
+            self._wildcard.add(key)
+            return
+
+        node = self._root
+        for k in path:
+            node = node.children.setdefault(k, _TrieNode())
+        node.keys.add(key)
+
+    def remove(self, path: tuple, key):
+        self._keys.discard(key)
+        if path == (".",):
+            self._wildcard.discard(key)
+            return
+
+        visited = [self._root]
+        for k in path:
+            node = visited[-1].children.get(k, None)
+            if node is None:
+                return
+            visited.append(node)
+        visited[-1].keys.discard(key)
+
+        # prune the empty nodes
+        for i in range(len(path), 0, -1):
+            node = visited[i]
+            if len(node.keys) > 0 or len(node.children) > 0:
+                break
+            visited[i - 1].children.pop(path[i - 1])
+
+    def match(self, diff_index: DiffIndex) -> set:
+        if len(diff_index.diff) == 0:
+            return set(self._keys)
+
+        matched = set(self._wildcard)
+        for op, path_, old, new in diff_index.diff:
+            # on create
+            if old is None and len(path_) == 0:
+                _match_model(self._root, diff_index.created, matched)
+            else:
+                _match_path(self._root, path_[1:], matched)
+        return matched
+
+
+class _TrieNode:
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children = dict()
+        self.keys = set()
+
+
+def _match_path(node: _TrieNode, path: tuple, matched: set):
+    # every prefix of the changed path, i.e., the
+    # subscribed subtrees containing the change
+    matched.update(node.keys)
+    for k in path:
+        node = node.children.get(k, None)
+        if node is None:
+            return
+        matched.update(node.keys)
+
+
+def _match_model(node: _TrieNode, d, matched: set):
+    # subscribed paths that exist in the model
+    to_visit = [(node, d)]
+    for n, d in to_visit:
+        matched.update(n.keys)
+        if type(d) is not dict:
             continue
-        for _k, _v in n.items():
-            to_visit.append([_v, prefix + [_k]])
-    return result
+        for k, child in n.children.items():
+            if k in d:
+                to_visit.append((child, d[k]))
 
 
 def _from_path_tuple(p: tuple):
@@ -1,12 +1,22 @@
 import os
+import time
+import asyncio
 import logging
 import kopf
 
 import digi.util as util
+import digi.metrics as metrics
 from digi.mount import Mounter
 
 
-def run():
+def run(coalesce: float = None):
+    """
+    Runs the driver. If coalesce (or the COALESCE env, in
+    seconds) is set, bursty updates to the model are coalesced:
+    the handlers run once against the latest spec after no
+    update arrives within the window, with the diff since
+    the last handled generation.
+    """
     g = os.environ["GROUP"]
     v = os.environ["VERSION"]
     r = os.environ["PLURAL"]
@@ -21,6 +31,12 @@ def run():
     # prevent printing root
     logging.getLogger().addHandler(logging.NullHandler())
 
+    if coalesce is None:
+        coalesce = float(os.environ.get("COALESCE", 0))
+
+    if metrics.port > 0:
+        metrics.serve()
+
     if os.environ.get("MOUNTER", "true") != "false":
         Mounter(g, v, r, n, ns, log_level=log_level).start()
 
@@ -43,25 +59,56 @@ def run():
     def configure(settings: kopf.OperatorSettings, **_):
         settings.persistence.progress_storage = kopf.AnnotationsProgressStorage()
         settings.posting.level = log_level
+        if coalesce > 0:
+            # kopf handles the latest of the batched events
+            # and diffs it against the last handled one
+            settings.batching.batch_window = coalesce
 
     from digi.reconcile import rc
 
+    @kopf.on.startup(registry=_registry)
+    async def set_loop(**_):
+        # async handlers are awaited on the operator's loop
+        rc.loop = asyncio.get_running_loop()
+
+    # keep the model cache up to date for conditional writes
+    kopf.on.event(**_model, **_kwargs)(util.cache_event_fn(g, v, r, n, ns))
+
     # TBD selectively add decorator
 
     @kopf.on.create(**_model, **_kwargs)
     @kopf.on.resume(**_model, **_kwargs)
     @kopf.on.update(**_model, **_kwargs)
-    def reconcile(meta, *args, **kwargs):
+    def reconcile(meta, spec, *args, **kwargs):
         gen = meta["generation"]
         # skip the last self-write
         # TBD for parallel reconciliation may need to lock rc.gen before patch
         if gen == rc.skip_gen:
             logger.info(f"Skipping gen {gen}")
+            rc.handled_gen = gen
             return
 
-        spec = rc.run(*args, **kwargs)
+        if gen > rc.handled_gen + 1 >= 1:
+            logger.info(f"Coalesced gen {rc.handled_gen + 1} to {gen}")
+
+        proc_spec = rc.run(spec, *args, **kwargs)
+
+        # only send the changes made by the handlers
+        patch = util.merge_patch(dict(spec), proc_spec)
+        if len(patch) == 0:
+            logger.info(f"No changes to patch at gen {gen}")
+            rc.handled_gen = gen
+            return
+
+        # piggyback the profile on the write
+        if metrics.to_obs and isinstance(patch.get("obs", {}), dict):
+            patch.setdefault("obs", {})["profile"] = metrics.summary()
+
+        start = time.perf_counter() if metrics.enabled else 0
         _, resp, e = util.check_gen_and_patch_spec(g, v, r, n, ns,
-                                                   spec, gen=gen)
+                                                   patch, gen=gen)
+        if metrics.enabled:
+            metrics.observe("patch_latency_seconds", time.perf_counter() - start)
         if e is not None:
             if e.status == util.DriverError.GEN_OUTDATED:
                 # retry s.t. the diff object contains the past changes
@@ -75,6 +122,7 @@ def run():
         new_gen = resp["metadata"]["generation"]
         if gen + 1 == new_gen:
             rc.skip_gen = new_gen
+        rc.handled_gen = gen
         logger.info(f"Done reconciliation")
 
     @kopf.on.delete(**_model, **_kwargs, optional=True)
@@ -82,4 +130,5 @@ def run():
         _, _ = args, kwargs
         # _stop.set()
 
-    _ready, _stop = util.run_operator(_registry, log_level=log_level)
+    _ready, _stop = util.run_operator(_registry, log_level=log_level,
+                                      namespaces=[ns])
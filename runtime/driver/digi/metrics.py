@@ -0,0 +1,155 @@
+"""Driver metrics in the Prometheus text format."""
+
+import os
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from digi import logger
+
+# the metrics are served on METRICS_PORT and, if METRICS_OBS
+# is set, summarized into the model's obs; when neither is set
+# the recording sites only check the enabled flag
+port = int(os.environ.get("METRICS_PORT", 0))
+to_obs = os.environ.get("METRICS_OBS", "false") == "true"
+enabled = port > 0 or to_obs
+
+_prefix = "digi_"
+_buckets = (.001, .005, .01, .05, .1, .5, 1, 5, float("inf"))
+
+_help = {
+    "handler_calls": "Number of handler invocations.",
+    "handler_skips": "Number of events a handler's condition skipped.",
+    "handler_latency_seconds": "Handler latency in seconds.",
+    "reconcile_latency_seconds": "Latency of a reconciliation (rc.run) in seconds.",
+    "patch_latency_seconds": "Latency of patching the model in seconds.",
+    "api_requests": "Number of requests sent to the apiserver.",
+    "client_connections_created": "Number of connections opened by the pooled client.",
+    "client_connections_reused": "Number of requests the pooled client sent on a kept-alive connection.",
+    "mount_conflicts": "Number of mounter writes retried after a conflict.",
+    "mount_retries_exhausted": "Number of mounter writes given up after the retry budget.",
+}
+
+_lock = threading.Lock()
+# keyed by metric name and then the sorted label items
+_counters = defaultdict(lambda: defaultdict(float))
+_histograms = defaultdict(dict)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(_buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        for i, b in enumerate(_buckets):
+            if v <= b:
+                self.counts[i] += 1
+                break
+        self.sum += v
+        self.count += 1
+
+
+def inc(name: str, v: float = 1, **labels):
+    with _lock:
+        _counters[name][tuple(sorted(labels.items()))] += v
+
+
+def observe(name: str, v: float, **labels):
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        h = _histograms[name].get(key, None)
+        if h is None:
+            h = _histograms[name][key] = Histogram()
+        h.observe(v)
+
+
+def render() -> str:
+    import digi.util as util
+
+    lines = list()
+    with _lock:
+        counters = {n: dict(c) for n, c in _counters.items()}
+        counters["api_requests"] = {(("verb", verb),): v
+                                    for verb, v in util.api_calls.items()}
+
+        for name, samples in counters.items():
+            _header(lines, name, "counter")
+            for labels, v in samples.items():
+                lines.append(f"{_prefix}{name}_total{_labels(labels)} {v}")
+
+        for name, samples in _histograms.items():
+            _header(lines, name, "histogram")
+            for labels, h in samples.items():
+                acc = 0
+                for b, c in zip(_buckets, h.counts):
+                    acc += c
+                    le = "+Inf" if b == float("inf") else str(b)
+                    lines.append(f"{_prefix}{name}_bucket"
+                                 f"{_labels(labels + (('le', le),))} {acc}")
+                lines.append(f"{_prefix}{name}_sum{_labels(labels)} {h.sum}")
+                lines.append(f"{_prefix}{name}_count{_labels(labels)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> dict:
+    """Per handler counts and average latencies, and the
+    average reconcile and patch latencies."""
+    handlers = defaultdict(dict)
+    with _lock:
+        for attr, name in [("calls", "handler_calls"),
+                           ("skips", "handler_skips")]:
+            for labels, v in _counters[name].items():
+                handlers[dict(labels)["handler"]][attr] = int(v)
+        for labels, h in _histograms["handler_latency_seconds"].items():
+            handlers[dict(labels)["handler"]]["latency"] = _avg(h)
+
+        result = {"handlers": dict(handlers)}
+        for name in ["reconcile_latency_seconds", "patch_latency_seconds"]:
+            h = _histograms[name].get((), None)
+            if h is not None:
+                result[name] = _avg(h)
+    return result
+
+
+def serve(port_: int = None):
+    port_ = port if port_ is None else port_
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args, **kwargs):
+            _, _ = args, kwargs
+
+    server = ThreadingHTTPServer(("", port_), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on :{port_}/metrics")
+    return server
+
+
+def _header(lines: list, name: str, typ: str):
+    suffix = "_total" if typ == "counter" else ""
+    lines.append(f"# HELP {_prefix}{name}{suffix} {_help.get(name, name)}")
+    lines.append(f"# TYPE {_prefix}{name}{suffix} {typ}")
+
+
+def _labels(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _avg(h: Histogram) -> float:
+    return round(h.sum / h.count, 6) if h.count > 0 else 0.0
@@ -1,10 +1,16 @@
+import os
 import sys
+import copy
+import time
+import asyncio
 import logging
-from collections import defaultdict
+import threading
+from typing import Callable
 import kopf
 from kopf.engines import loggers
 
 import digi.util as util
+import digi.metrics as metrics
 from digi.util import parse_gvr, spaced_name, parse_spaced_name
 
 """
@@ -22,6 +28,13 @@ Event propagation:
 """
 
 
+# retries of the conflicted writes to the parent, with a
+# jittered exponential backoff from base up to cap seconds
+retry_budget = int(os.environ.get("MOUNT_RETRY_BUDGET", 10))
+backoff_base = float(os.environ.get("MOUNT_BACKOFF_BASE", 0.01))
+backoff_cap = float(os.environ.get("MOUNT_BACKOFF_CAP", 1))
+
+
 class Watch:
     def __init__(self, g, v, r, n, ns="default", *,
                  create_fn=None,
@@ -45,6 +58,9 @@ class Watch:
             settings.persistence.progress_storage = kopf.AnnotationsProgressStorage()
             settings.posting.level = log_level
 
+        # keep the model cache up to date for conditional writes
+        kopf.on.event(*_args, **_kwargs)(util.cache_event_fn(g, v, r, n, ns))
+
         if create_fn is not None:
             kopf.on.create(*_args, **_kwargs)(create_fn)
         if resume_fn is not None:
@@ -57,12 +73,14 @@ class Watch:
             kopf.on.field(field=field, *_args, **_kwargs)(field_fn)
         assert create_fn or resume_fn or update_fn or delete_fn, "no handler provided"
 
+        self._ns = ns
         self._ready_flag, self._stop_flag = None, None
 
     def start(self):
         self._ready_flag, self._stop_flag = util.run_operator(
             self._registry, log_level=self._log_level,
             skip_log_setup=True,
+            namespaces=[self._ns],
         )
         return self
 
@@ -72,11 +90,194 @@ class Watch:
         return self
 
 
+class SharedWatch:
+    """
+    Watches of many models on one loop thread: one kopf
+    operator (registry) per kind and namespace, started when
+    the first model of the kind in the namespace is added,
+    dispatches the events to the handlers of the watched
+    models through an index keyed by (gvr, namespace, name).
+    Adding and removing a model updates the index only.
+    """
+
+    _events = ("create", "resume", "update", "delete")
+
+    def __init__(self, log_level=logging.INFO):
+        self._log_level = log_level
+        # handlers of the watched models
+        self._index = dict()
+        # flags of the operators keyed by the gvr and namespace
+        self._operators = dict()
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._index
+
+    def keys(self) -> list:
+        return list(self._index)
+
+    def add(self, g, v, r, n, ns="default", *,
+            create_fn=None,
+            resume_fn=None,
+            update_fn=None,
+            delete_fn=None):
+        gvr_str = util.gvr(g, v, r)
+        self._index[gvr_str, ns, n] = {
+            "create": create_fn,
+            "resume": resume_fn,
+            "update": update_fn,
+            "delete": delete_fn,
+        }
+
+        with self._lock:
+            ready_flag = self._operators.get((gvr_str, ns), (None, None))[0]
+            if ready_flag is None:
+                self._start_operator(g, v, r, ns)
+                return self
+
+        # the operator has listed the models of the kind when
+        # it started, so the model is created or resumed here
+        if ready_flag.is_set() and create_fn is not None:
+            f = asyncio.run_coroutine_threadsafe(
+                self._create_async(create_fn, g, v, r, n, ns), self._loop)
+            f.add_done_callback(
+                lambda f_: self._log_create_error(f_, gvr_str, n, ns))
+        return self
+
+    def remove(self, g, v, r, n, ns="default"):
+        self._index.pop((util.gvr(g, v, r), ns, n), None)
+        return self
+
+    def stop(self):
+        with self._lock:
+            for _, stop_flag in self._operators.values():
+                stop_flag.set()
+            self._operators = dict()
+        return self
+
+    def _start_operator(self, g, v, r, ns):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever,
+                             daemon=True).start()
+
+        gvr_str = util.gvr(g, v, r)
+        registry = util.KopfRegistry()
+        _args = (g, v, r)
+        _kwargs = {
+            "registry": registry,
+            # watch the indexed models only
+            "when": lambda name, namespace, **_:
+            (gvr_str, namespace, name) in self._index,
+        }
+        log_level = self._log_level
+
+        @kopf.on.startup(registry=registry)
+        def configure(settings: kopf.OperatorSettings, **_):
+            settings.persistence.progress_storage = kopf.AnnotationsProgressStorage()
+            settings.posting.level = log_level
+
+        # keep the model cache up to date for conditional writes
+        @kopf.on.event(*_args, **_kwargs)
+        async def on_event(name, namespace, **kwargs):
+            await util.cache_event_fn(g, v, r, name, namespace)(**kwargs)
+
+        for kind in self._events:
+            on_fn = getattr(kopf.on, kind)
+            extra = {"optional": True} if kind == "delete" else {}
+            on_fn(*_args, **_kwargs, **extra)(self._dispatch_fn(gvr_str, kind))
+
+        ready_flag, stop_flag = threading.Event(), threading.Event()
+        self._operators[gvr_str, ns] = ready_flag, stop_flag
+        asyncio.run_coroutine_threadsafe(
+            util.operator(registry, ready_flag=ready_flag, stop_flag=stop_flag,
+                          namespaces=[ns]),
+            self._loop)
+        util.logger.info(f"Started an operator for {gvr_str} in {ns}")
+
+    def _dispatch_fn(self, gvr_str, kind):
+        def fn(name, namespace, **kwargs):
+            handlers = self._index.get((gvr_str, namespace, name), None)
+            if handlers is None or handlers[kind] is None:
+                return
+            return handlers[kind](name=name, namespace=namespace, **kwargs)
+
+        fn.__name__ = f"on_{kind}"
+        return fn
+
+    async def _create_async(self, *args):
+        await self._loop.run_in_executor(None, self._create, *args)
+
+    @staticmethod
+    def _log_create_error(f, gvr_str, n, ns):
+        e = None if f.cancelled() else f.exception()
+        if e is not None:
+            util.logger.error(f"Unable to create {gvr_str} "
+                              f"{util.spaced_name(n, ns)}: {e}")
+
+    @staticmethod
+    def _create(create_fn, g, v, r, n, ns):
+        body = util.get_model(g, v, r, n, ns)
+        if body is None:
+            return
+        return create_fn(body=body, meta=body["metadata"],
+                         spec=body.get("spec", {}), diff=None,
+                         name=n, namespace=ns)
+
+
+class PatchBatcher:
+    """
+    Group commit of the patches to one model: the entries
+    submitted while a write is in flight (or within the
+    window) are sent in the next write, keeping the entry
+    of the highest generation per key. The first submitter
+    of a batch writes it; submit returns once the batch
+    containing the entry is written.
+    """
+
+    def __init__(self, write_fn: Callable[[dict], None], window: float = 0):
+        self._write_fn = write_fn
+        self._window = window
+        self._lock = threading.Lock()
+        # one write in flight
+        self._writing = threading.Lock()
+        # entries and generations keyed by the key
+        self._pending, self._gens = dict(), dict()
+        # done flag of the pending batch
+        self._batch = None
+
+    def submit(self, key, entry, gen: int = 0):
+        with self._lock:
+            if gen >= self._gens.get(key, gen):
+                self._pending[key], self._gens[key] = entry, gen
+            batch, leader = self._batch, self._batch is None
+            if leader:
+                batch = self._batch = threading.Event()
+
+        if not leader:
+            batch.wait()
+            return
+
+        if self._window > 0:
+            time.sleep(self._window)
+        try:
+            with self._writing:
+                with self._lock:
+                    entries = self._pending
+                    self._pending, self._gens = dict(), dict()
+                    self._batch = None
+                self._write_fn(entries)
+        finally:
+            batch.set()
+
+
 class Mounter:
     """Implements the mount semantics for a given (parent) digivice"""
 
     def __init__(self, g, v, r, n, ns="default",
-                 log_level=logging.INFO):
+                 log_level=logging.INFO,
+                 batch_window: float = None):
 
         """ children event handlers """
 
@@ -110,13 +311,7 @@ class Mounter:
             _g, _v, _r = util.gvr_from_body(body)
 
             # remove watch
-            gvr_str = util.gvr(_g, _v, _r)
-            nsn_str = util.spaced_name(name, namespace)
-
-            w = self._children_watches.get(gvr_str, {}).get(nsn_str, None)
-            if w is not None:
-                w.stop()
-                self._children_watches[gvr_str].pop(nsn_str, "")
+            self._children_watches.remove(_g, _v, _r, name, namespace)
 
             # will delete from parent
             _sync_to_parent(_g, _v, _r, name, namespace, spec=None,
@@ -126,12 +321,17 @@ class Mounter:
                               attrs_to_trim=None, *args, **kwargs):
             _, _ = args, kwargs
 
-            parent, prv, pgn = util.get_spec(g, v, r, n, ns)
+            # the parent from the watch-fed cache (read-only)
+            parent, prv, pgn = util.get_cached_spec(g, v, r, n, ns)
+            gvr_str = util.gvr(group, version, plural)
+            nsn_str = util.spaced_name(name, namespace)
+
+            # the cached parent may predate the mount
+            if not _has_child(parent, gvr_str, nsn_str, name):
+                parent, prv, pgn = util.get_spec(g, v, r, n, ns)
 
             # check if child exists
             mounts = parent.get("mount", {})
-            gvr_str = util.gvr(group, version, plural)
-            nsn_str = util.spaced_name(name, namespace)
 
             if (gvr_str not in mounts or
                     (nsn_str not in mounts[gvr_str] and
@@ -144,7 +344,7 @@ class Mounter:
 
             patch = models[n_]
             if attrs_to_trim is not None:
-                patch = util.trim_attr(patch, attrs_to_trim)
+                patch = util.trim_attr(copy.deepcopy(patch), attrs_to_trim)
 
             _, resp, e = util.check_gen_and_patch_spec(
                 group, version, plural,
@@ -166,79 +366,89 @@ class Mounter:
                             spec, diff, attrs_to_trim=None, *args, **kwargs):
             _, _ = args, kwargs
 
-            # propagation from child retries until succeed
-            while True:
-                parent, prv, pgn = util.get_spec(g, v, r, n, ns)
+            # the parent from the watch-fed cache (read-only)
+            parent, _, _ = util.get_cached_spec(g, v, r, n, ns)
+            gvr_str = util.gvr(group, version, plural)
+            nsn_str = util.spaced_name(name, namespace)
 
-                # check if child exists
-                mounts = parent.get("mount", {})
-                gvr_str = util.gvr(group, version, plural)
-                nsn_str = util.spaced_name(name, namespace)
+            # the cached parent may predate the mount
+            if not _has_child(parent, gvr_str, nsn_str, name):
+                parent, _, _ = util.get_spec(g, v, r, n, ns)
+            if not _has_child(parent, gvr_str, nsn_str, name):
+                self._logger.warning(f"unable to find the {nsn_str} or {name} in the {parent}")
+                return
 
-                if (gvr_str not in mounts or
-                        (nsn_str not in mounts[gvr_str] and
-                         name not in mounts[gvr_str])):
-                    self._logger.warning(f"unable to find the {nsn_str} or {name} in the {parent}")
-                    return
+            models = parent["mount"][gvr_str]
+            n_ = name if name in models else nsn_str
+
+            if spec is None:
+                entry = None  # will convert to json null
+            else:
+                if models[n_].get("mode", "hide") == "hide":
+                    if attrs_to_trim is None:
+                        attrs_to_trim = set()
+                    attrs_to_trim.add("mount")
+
+                # TBD rename to _gen_parent_spec
+                entry = {
+                    "spec": _gen_parent_patch(spec, diff, attrs_to_trim),
+                    "generation": meta["generation"],
+                }
 
-                models = mounts[gvr_str]
-                n_ = name if name in models else nsn_str
+            # merged with the concurrent updates of other children
+            # into one patch of the parent; returns once written
+            self._parent_batcher.submit((gvr_str, n_), entry,
+                                        gen=meta["generation"])
 
-                if spec is None:
-                    parent_patch = None  # will convert to json null
-                else:
-                    if models[n_].get("mode", "hide") == "hide":
-                        if attrs_to_trim is None:
-                            attrs_to_trim = set()
-                        attrs_to_trim.add("mount")
+        def _patch_parent(entries: dict):
+            # propagation from children retries with backoff until
+            # succeed or the retry budget runs out; each retry
+            # rebases the entries onto the latest cached parent
+            prv, attempt = None, 0
+            while True:
+                parent, prv, pgn = util.get_cached_spec(g, v, r, n, ns,
+                                                        stale_rv=prv)
+                mounts = parent.get("mount", {})
 
-                    # TBD rename to _gen_parent_spec
-                    parent_patch = _gen_parent_patch(spec, diff, attrs_to_trim)
+                parent_patch = dict()
+                for (gvr_str, n_), entry in entries.items():
+                    if n_ not in mounts.get(gvr_str, {}):
+                        self._logger.warning(f"unable to find the {n_} in the {parent}")
+                        continue
+                    parent_patch.setdefault(gvr_str, dict())[n_] = entry
 
                 # add roots
-                if parent_patch is None:
-                    # only child
-                    if len(mounts[gvr_str]) == 1:
-                        parent_patch = {
-                            "mount": {
-                                gvr_str: None
-                            }
-                        }
-                    else:
-                        parent_patch = {
-                            "mount": {
-                                gvr_str: {
-                                    n_: None
-                                }
-                            }
-                        }
-                else:
-                    parent_patch = {
-                        "mount": {
-                            gvr_str: {
-                                n_: {
-                                    "spec": parent_patch,
-                                    "generation": meta["generation"],
-                                }
-                            }
-                        }}
+                for gvr_str, models in parent_patch.items():
+                    # all children removed
+                    if len(mounts[gvr_str]) == len(models) and \
+                            all(m is None for m in models.values()):
+                        parent_patch[gvr_str] = None
+
+                if len(parent_patch) == 0:
+                    return
 
                 # maybe rejected if parent has been updated;
                 # continue to try until succeed
-                resp, e = util.patch_spec(g, v, r, n, ns, parent_patch, rv=prv)
+                resp, e = util.patch_spec(g, v, r, n, ns,
+                                          {"mount": parent_patch}, rv=prv)
                 if e is not None:
                     self._logger.warning(f"Failed to sync to parent due to {e}")
-                    if e.status != 409:
+                    if e.status != 409 or not _backoff("sync_to_parent", attempt):
                         return
-                    # time.sleep(1)
+                    attempt += 1
                 else:
                     new_gen = resp["metadata"]["generation"]
                     if pgn + 1 == new_gen:
                         self._parent_skip_gen = new_gen
-                    break
+                    return
+
+        def _has_child(parent_spec, gvr_str, nsn_str, name):
+            models = parent_spec.get("mount", {}).get(gvr_str, {})
+            return nsn_str in models or name in models
 
         def _gen_parent_patch(child_spec, diff, attrs_to_trim=None):
-            child_spec = dict(child_spec)
+            # the child's spec may be shared with the cache
+            child_spec = copy.deepcopy(child_spec)
 
             if diff is not None:
                 child_spec = util.apply_diff({"spec": child_spec}, diff)["spec"]
@@ -268,7 +478,7 @@ class Mounter:
             _prune_mounts(mounts, meta)
 
         def _prune_mounts(mounts, meta):
-            rv = meta["resourceVersion"]
+            rv, attempt = meta["resourceVersion"], 0
             while True:
                 to_prune = list()
                 for gvr_str, models in mounts.items():
@@ -290,9 +500,26 @@ class Mounter:
                     return
 
                 self._logger.info(f"Prune mount will retry due to: {e}")
-                spec, rv, _ = util.get_spec(g, v, r, n, ns)
+                if not _backoff("prune", attempt):
+                    return
+                attempt += 1
+                spec, rv, _ = util.get_cached_spec(g, v, r, n, ns,
+                                                   stale_rv=rv)
                 mounts = spec.get("mount", {})
 
+        def _backoff(op, attempt) -> bool:
+            # wait before the retry of a conflicted write; False
+            # if the retry budget has run out
+            if attempt >= retry_budget:
+                self._logger.warning(f"Giving up {op} after {attempt} retries")
+                if metrics.enabled:
+                    metrics.inc("mount_retries_exhausted", op=op)
+                return False
+            if metrics.enabled:
+                metrics.inc("mount_conflicts", op=op)
+            time.sleep(util.backoff(attempt, backoff_base, backoff_cap))
+            return True
+
         def on_parent_delete(*args, **kwargs):
             _, _ = args, kwargs
             self.stop()
@@ -304,47 +531,39 @@ class Mounter:
                 gvr = parse_gvr(gvr_str)  # child's gvr
 
                 for nsn_str, m in models.items():
-                    nsn = parse_spaced_name(nsn_str)
                     # in case default ns is omitted in the model
-                    nsn_str = spaced_name(*nsn)
+                    _n, _ns = parse_spaced_name(nsn_str)
 
-                    if gvr_str in self._children_watches and \
-                            nsn_str in self._children_watches[gvr_str]:
+                    if (gvr_str, _ns, _n) in self._children_watches:
                         continue
 
                     # TBD: add child event handlers
-                    self._children_watches[gvr_str][nsn_str] \
-                        = Watch(*gvr, *nsn,
-                                create_fn=on_child_create,
-                                resume_fn=on_child_create,
-                                update_fn=on_child_update,
-                                delete_fn=on_child_delete,
-                                log_level=log_level).start()
+                    self._children_watches.add(*gvr, _n, _ns,
+                                               create_fn=on_child_create,
+                                               resume_fn=on_child_create,
+                                               update_fn=on_child_update,
+                                               delete_fn=on_child_delete)
 
             # trim watches no longer needed
-            for gvr_str, model_watches in self._children_watches.items():
-                mw_to_delete = set()
-                for nsn_str, w in model_watches.items():
-                    models = mounts.get(gvr_str, {})
-                    if nsn_str not in models and \
-                            util.trim_default_space(nsn_str) not in models:
-                        w.stop()
-                        mw_to_delete.add(nsn_str)
-
-                for d in mw_to_delete:
-                    model_watches.pop(d, None)
+            for gvr_str, _ns, _n in self._children_watches.keys():
+                models = mounts.get(gvr_str, {})
+                nsn_str = spaced_name(_n, _ns)
+                if nsn_str not in models and \
+                        util.trim_default_space(nsn_str) not in models:
+                    self._children_watches.remove(*parse_gvr(gvr_str),
+                                                  _n, _ns)
 
         def _gen_child_patch(parent_spec, gvr_str, nsn_str):
             mount_entry = parent_spec \
                 .get("mount", {}) \
                 .get(gvr_str, {}) \
                 .get(nsn_str, {})
-            if mount_entry.get("mode", "hide") == "hide":
-                mount_entry.get("spec", {}).pop("mount", {})
-
             if mount_entry.get("status", "inactive") == "active":
-                spec = mount_entry.get("spec", None)
+                # the parent's spec may be shared with the cache
+                spec = copy.deepcopy(mount_entry.get("spec", None))
                 if spec is not None:
+                    if mount_entry.get("mode", "hide") == "hide":
+                        spec.pop("mount", {})
                     spec = util.trim_attr(spec, {"status", "output", "obs"})
 
                 gen = mount_entry.get("generation", sys.maxsize)
@@ -407,9 +626,14 @@ class Mounter:
                                    delete_fn=on_parent_delete, delete_optional=True,
                                    log_level=log_level)
 
-        # subscribe to the events of the child models;
-        # keyed by the gvr and then spaced name
-        self._children_watches = defaultdict(dict)
+        # batch the writes of the children to the parent
+        if batch_window is None:
+            batch_window = float(os.environ.get("MOUNT_BATCH_WINDOW", 0))
+        self._parent_batcher = PatchBatcher(_patch_parent, window=batch_window)
+
+        # subscribe to the events of the child models on one
+        # loop thread; keyed by the gvr, namespace and name
+        self._children_watches = SharedWatch(log_level=log_level)
 
         # last handled generation of a child, keyed by model_id;
         # used when update the children because the parent's copy
@@ -434,9 +658,7 @@ class Mounter:
 
     def stop(self):
         self._parent_watch.stop()
-        for _, mws in self._children_watches.items():
-            for _, w in mws.items():
-                w.stop()
+        self._children_watches.stop()
         return self
 
 
@@ -7,6 +7,14 @@ from digi.reconcile import rc
 
 """Filters."""
 
+# handlers registered by the decorators keyed by the
+# decorated fn, each of form (name, binding)
+_registered = dict()
+
+# arguments the reconciler calls the handlers with
+_params = ["subview", "proc_view", "view", "old_view", "mount",
+           "obs", "back_prop", "diff", "diff_index"]
+
 
 def meta(*args, **kwargs):
     # if decorator not parameterized
@@ -19,6 +27,9 @@ def meta(*args, **kwargs):
             _attr(fn, path="meta." + args[0], *args[1:], **kwargs)
         elif "path" in kwargs:
             _attr(fn, path="meta." + kwargs.pop("path"), *args, **kwargs)
+        else:
+            # parameterized w/o a path, e.g., @meta(prio=1)
+            _attr(fn, path="meta", **kwargs)
         return fn
 
     return decorator
@@ -34,6 +45,9 @@ def control(*args, **kwargs):
             _attr(fn, path="control." + args[0], *args[1:], **kwargs)
         elif "path" in kwargs:
             _attr(fn, path="control." + kwargs.pop("path"), *args, **kwargs)
+        else:
+            # parameterized w/o a path, e.g., @control(prio=1)
+            _attr(fn, path="control", **kwargs)
         return fn
 
     return decorator
@@ -49,6 +63,9 @@ def data(*args, **kwargs):
             _attr(fn, path="data." + args[0], *args[1:], **kwargs)
         elif "path" in kwargs:
             _attr(fn, path="data." + kwargs.pop("path"), *args, **kwargs)
+        else:
+            # parameterized w/o a path, e.g., @data(prio=1)
+            _attr(fn, path="data", **kwargs)
         return fn
 
     return decorator
@@ -64,6 +81,9 @@ def obs(*args, **kwargs):
             _attr(fn, path="obs." + args[0], *args[1:], **kwargs)
         elif "path" in kwargs:
             _attr(fn, path="obs." + kwargs.pop("path"), *args, **kwargs)
+        else:
+            # parameterized w/o a path, e.g., @obs(prio=1)
+            _attr(fn, path="obs", **kwargs)
         return fn
 
     return decorator
@@ -79,6 +99,9 @@ def mount(*args, **kwargs):
             _attr(fn, path="mount." + args[0], *args[1:], **kwargs)
         elif "path" in kwargs:
             _attr(fn, path="mount." + kwargs.pop("path"), *args, **kwargs)
+        else:
+            # parameterized w/o a path, e.g., @mount(prio=1)
+            _attr(fn, path="mount", **kwargs)
         return fn
 
     return decorator
@@ -97,7 +120,7 @@ def attr(*args, **kwargs):
     return decorator
 
 
-def _attr(fn, path=".", prio=0):
+def _attr(fn, path=".", prio=0, timeout=None):
     # preprocess the path str -> tuple of str
     _path = list()
     ps = path.split(".")
@@ -130,9 +153,20 @@ def _attr(fn, path=".", prio=0):
     # XXX assume default gv in gvr until fix dot in path literal;
     # _path = path.split(".")
 
-    # TBD: join multiple path to allow multiple decorators per handler
     _path = tuple(_path)
 
+    # stacked decorators subscribe the registered handler
+    # to one more path instead of registering fn again
+    if fn in _registered:
+        name, binding = _registered[fn]
+        if binding["typ"] is None:
+            binding["typ"] = child_typ
+        rc.subscribe(name, _path, prio)
+        return
+    # names the compiled binding refers to; typ can be
+    # set by a stacked decorator later
+    binding = {"fn": fn, "typ": child_typ}
+
     sig = inspect.signature(fn)
 
     # allow the handler declaration to omit arguments
@@ -182,6 +216,11 @@ def _attr(fn, path=".", prio=0):
             kwarg_filter.update({"diff": p})
             args[p] = None
 
+    for p in ["diff_index", "di"]:
+        if p in sig.parameters:
+            kwarg_filter.update({"diff_index": p})
+            args[p] = None
+
     for p in ["typ", "child_typ"]:
         if p in sig.parameters:
             kwarg_filter.update({"typ": p})
@@ -206,28 +245,32 @@ def _attr(fn, path=".", prio=0):
             kwarg_filter["back_prop"] = k
         elif i == 7:
             kwarg_filter["diff"] = k
+        elif i == 8:
+            kwarg_filter["diff_index"] = k
         else:
             break
 
-    def wrapper_fn(subview, proc_view, view,
-                   old_view, mount, obs, back_prop,
-                   diff):
-        kwargs = dict()
-        for _k, _v in [("subview", subview),
-                       ("proc_view", proc_view),
-                       ("view", view),
-                       ("old_view", old_view),
-                       ("mount", mount),
-                       ("obs", obs),
-                       ("back_prop", back_prop),
-                       ("diff", diff),
-                       ("typ", child_typ),
-                       ]:
-            if _k in kwarg_filter:
-                kwargs[kwarg_filter[_k]] = _v
-        fn(**kwargs)
-
-    rc.add(handler=wrapper_fn,
-           priority=prio,
-           condition=filter_.has_diff,
-           path=_path)
+    wrapper_fn = _compile(fn, kwarg_filter, binding)
+
+    name = rc.add(handler=wrapper_fn,
+                  priority=prio,
+                  condition=filter_.has_diff,
+                  path=_path,
+                  name=fn.__name__,
+                  timeout=timeout)
+    _registered[fn] = name, binding
+
+
+def _compile(fn, kwarg_filter: dict, binding: dict):
+    # generate the wrapper as a keyword call of fn, e.g.,
+    # fn(sv=subview, mounts=mount), so that binding the
+    # arguments per call builds no dict; async handlers
+    # are awaited on the operator's loop and cancelled
+    # after the timeout (in seconds)
+    call = ", ".join(f"{kwarg_filter[k]}={k}"
+                     for k in _params + ["typ"] if k in kwarg_filter)
+    is_async = inspect.iscoroutinefunction(fn)
+    src = f"{'async ' if is_async else ''}def wrapper_fn({', '.join(_params)}):\n" \
+          f"    {'await ' if is_async else ''}fn({call})\n"
+    exec(compile(src, f"<digi.on {fn.__qualname__}>", "exec"), binding)
+    return binding.pop("wrapper_fn")
@@ -1,30 +1,186 @@
 """Logic and policy processors"""
 
-import pyjq
+import os
 import time
+import ctypes
+import builtins
+import threading
+from concurrent.futures import ThreadPoolExecutor, \
+    TimeoutError as FutureTimeoutError
+import pyjq
+from functools import lru_cache
 from digi import logger
-from digi.view import ModelView
+import digi.util as util
+from digi.view import ModelView, DotView
 
+# macros are bound as jq variables on each evaluation
+_macros = {
+    "time": time.time,
+    # ...
+}
 
-def jq(policy: str):
-    # preproc macro
-    _macros = {
-        "$time": str(time.time()),
-        # ...
-    }
 
-    for _m, _v in _macros.items():
-        policy = policy.replace(_m, _v)
+@lru_cache(maxsize=int(os.environ.get("JQ_CACHE_SIZE", 128)))
+def _compile_jq(policy: str):
+    # the program takes the macros and the view as input
+    # s.t. it is compiled once per policy text
+    binds = "".join(f".{_m} as ${_m} | " for _m in _macros)
+    return pyjq.compile(f"{binds}.view | ({policy})")
+
+
+def _invalid(proc: str, policy: str, e: Exception):
+    # a policy that fails to compile is reported and skipped
+    # s.t. it does not block the other handlers
+    logger.error(f"processor: {proc} unable to compile policy {policy}: {e}")
+
+    def fn(*args, **kwargs):
+        _, _ = args, kwargs
+
+    return fn
+
 
+def jq(policy: str):
     logger.info(f"processor: jq running policy {policy}")
+    try:
+        program = _compile_jq(policy)
+    except ValueError as e:
+        return _invalid("jq", policy, e)
 
     def fn(proc_view, *args, **kwargs):
         _, _ = args, kwargs
         with ModelView(proc_view) as mv:
-            mv.update(pyjq.one(policy, mv))
+            _input = {_m: _f() for _m, _f in _macros.items()}
+            # jq takes a materialized view; the models in its
+            # output update the view, where only the changed
+            # attributes of a model are written
+            _input["view"] = view = mv.to_dict()
+            for n, new in program.one(_input).items():
+                old = view.get(n, None)
+                if isinstance(old, dict) and isinstance(new, dict):
+                    util.apply_merge_patch(mv[n], util.merge_patch(old, new))
+                else:
+                    mv[n] = new
+
+    return fn
+
+
+# builtins available to the python policies
+_py_builtins = {
+    _b: getattr(builtins, _b)
+    for _b in ["abs", "all", "any", "bool", "dict", "enumerate",
+               "filter", "float", "int", "isinstance", "len", "list",
+               "map", "max", "min", "range", "round", "set", "sorted",
+               "str", "sum", "tuple", "zip", "None", "True", "False"]
+}
+
+# time budget per evaluation of a python policy in seconds;
+# 0 disables the budget
+_py_budget = float(os.environ.get("REFLEX_BUDGET", 0.1))
+
+
+@lru_cache(maxsize=int(os.environ.get("PY_CACHE_SIZE", 128)))
+def _compile_py(policy: str):
+    code = compile(policy, "<reflex>", "exec")
+    # disallow dunder attributes and names to keep the
+    # policy within the restricted namespace
+    to_visit = [code]
+    for c in to_visit:
+        for name in c.co_names:
+            if name.startswith("__"):
+                raise ValueError(f"{name} is not allowed in policy")
+        to_visit.extend(const for const in c.co_consts
+                        if hasattr(const, "co_names"))
+    return code
+
+
+def py(policy: str, budget: float = None):
+    """
+    Python policy, e.g., 'if time - motionsensor_test.obs.
+    last_triggered_time <= 600: root.control.mode.intent = "work"'.
+    The policy runs against the model view where the root and
+    the mounted models are dot accessible by their (safe) names,
+    e.g., root and motionsensor_test, and the whole view as view;
+    time is the current time.
+    """
+    logger.info(f"processor: py running policy {policy}")
+    try:
+        code = _compile_py(policy)
+    except (SyntaxError, ValueError) as e:
+        return _invalid("py", policy, e)
+    budget = _py_budget if budget is None else budget
+
+    def fn(proc_view, *args, **kwargs):
+        _, _ = args, kwargs
+        with ModelView(proc_view) as mv, DotView(mv) as dv:
+            ns = {_k: _v for _k, _v in dv.items()}
+            ns.update({
+                "__builtins__": _py_builtins,
+                "view": dv,
+                "time": time.time(),
+            })
+            _exec(code, ns, budget)
 
     return fn
 
 
-def py(policy: str):
-    return NotImplemented
+def _exec(code, ns: dict, budget: float):
+    if budget <= 0:
+        exec(code, ns)
+        return
+
+    # the policy runs on a worker thread and is interrupted
+    # by an async exception once over the budget; unlike a
+    # trace function, this does not depend on the policy
+    # emitting trace events
+    global _py_worker
+    with _py_lock:
+        if _py_worker is None:
+            _py_worker = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix="reflex")
+        worker = _py_worker
+
+    state = {"thread": None}
+    lock = threading.Lock()
+
+    def run():
+        with lock:
+            state["thread"] = threading.get_ident()
+        try:
+            exec(code, ns)
+        finally:
+            with lock:
+                state["thread"] = None
+
+    f = worker.submit(run)
+    try:
+        f.result(timeout=budget)
+        return
+    except FutureTimeoutError:
+        pass
+
+    with lock:
+        if state["thread"] is not None:
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(state["thread"]), ctypes.py_object(_Interrupted))
+    try:
+        f.result(timeout=budget)
+    except _Interrupted:
+        pass
+    except FutureTimeoutError:
+        # stuck outside the interpreter loop, e.g., in a C
+        # call; the worker is abandoned and replaced
+        with _py_lock:
+            if _py_worker is worker:
+                _py_worker = None
+        worker.shutdown(wait=False)
+    raise TimeoutError(f"policy exceeded its time budget {budget}s")
+
+
+class _Interrupted(BaseException):
+    # raised in the worker; a BaseException s.t. the policy
+    # cannot catch it with except Exception
+    pass
+
+
+_py_worker = None
+_py_lock = threading.Lock()
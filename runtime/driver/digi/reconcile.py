@@ -1,12 +1,20 @@
 import os
+import copy
+import time
+import bisect
 import typing
+import asyncio
+import inspect
+import threading
 import traceback
 import logging
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import digi.util as util
 import digi.filter as filter_
 import digi.processor as processor
+import digi.metrics as metrics
 
 
 class HandlerType:
@@ -14,18 +22,148 @@ class HandlerType:
     REFLEX = 2
 
 
+Handler = namedtuple("Handler", ["fn", "condition", "paths", "priority",
+                                 "name", "is_async", "timeout"])
+
+
+class HandlerTable:
+    """
+    Handlers in execution order, i.e., by (priority, seq) where
+    seq is the insertion order, and the trie of their view paths.
+    Handlers are inserted, removed and reprioritized in place,
+    keeping the order by bisect; each change bumps the version
+    and returns the names of the changed handlers.
+    """
+
+    def __init__(self):
+        self.version = 0
+        # handler info keyed by the handler's name
+        self._info = OrderedDict()
+        # (priority, seq, name) of the enabled handlers, sorted
+        self._order = list()
+        self._handlers = dict()
+        # trie of the view paths subscribed by handlers
+        # conditioned on has_diff, keyed by their name;
+        # the other handlers are kept in self._untracked.
+        self._trie = filter_.PathTrie()
+        self._untracked = set()
+        self._seq = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._info
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    @property
+    def handlers(self) -> list:
+        return [self._handlers[n] for _, _, n in self._order]
+
+    def get(self, name: str) -> dict:
+        return self._info.get(name, None)
+
+    def names(self, typ=None) -> list:
+        return [n for n, info in self._info.items()
+                if typ is None or info["type"] == typ]
+
+    def insert(self, name: str, info: dict) -> list:
+        base = name
+        while name in self._info:
+            # TBD perhaps use deterministic name
+            name = base + util.uuid_str()
+
+        self._info[name] = dict(info, seq=self._seq)
+        self._seq += 1
+        self._enable(name)
+        self.version += 1
+        return [name]
+
+    def remove(self, name: str) -> list:
+        if name not in self._info:
+            return []
+
+        self._disable(name)
+        self._info.pop(name)
+        self.version += 1
+        return [name]
+
+    def update(self, name: str, **patch) -> list:
+        info = self._info[name]
+        if all(k in info and (info[k] is v or info[k] == v)
+               for k, v in patch.items()):
+            return []
+
+        self._disable(name)
+        info.update(patch)
+        self._enable(name)
+        self.version += 1
+        return [name]
+
+    def reprioritize(self, name: str, priority: int) -> list:
+        return self.update(name, priority=priority)
+
+    def match(self, index: filter_.DiffIndex) -> set:
+        # names of the handlers to run on the diff
+        return self._trie.match(index) | self._untracked
+
+    def ordered(self, names) -> list:
+        return [self._handlers[n] for n in
+                sorted(names, key=lambda n: (self._info[n]["priority"],
+                                             self._info[n]["seq"]))]
+
+    def _enable(self, name: str):
+        info = self._info[name]
+        # treat negative priority as disabled
+        if info["priority"] < 0:
+            return
+
+        h = Handler(
+            fn=info["fn"], condition=info["condition"],
+            paths=info["view_paths"], priority=info["priority"], name=name,
+            is_async=inspect.iscoroutinefunction(info["fn"]),
+            timeout=info["timeout"],
+        )
+        self._handlers[name] = h
+        bisect.insort(self._order, (h.priority, info["seq"], name))
+        if h.condition is filter_.has_diff:
+            for p in h.paths:
+                self._trie.add(p, name)
+        else:
+            self._untracked.add(name)
+
+    def _disable(self, name: str):
+        h = self._handlers.pop(name, None)
+        if h is None:
+            return
+
+        key = (h.priority, self._info[name]["seq"], name)
+        del self._order[bisect.bisect_left(self._order, key)]
+        if h.condition is filter_.has_diff:
+            for p in h.paths:
+                self._trie.remove(p, name)
+        else:
+            self._untracked.discard(name)
+
+
 class __Reconciler:
     def __init__(self):
-        # handlers are stored as tuples (fn, condition, path, priority)
+        # handlers are stored as Handler tuples
+        # (fn, condition, paths, priority, name, is_async, timeout);
         # the higher the priority value, the higher the priority;
         # default priority is 0; low priority handlers are run first;
         # priority lower than 0 is skipped.
         # - condition: a function that decides whether the handler
         #   should be run or not.
-        # - path: the attribute subtree the handler subscribes to
-
-        # sorted list of handlers in execution order
-        self.handlers = list()
+        # - paths: the attribute subtrees the handler subscribes to;
+        #   a handler subscribed to several subtrees runs at most
+        #   once per event and gets a forest of them as subview
+        # - is_async: whether the handler is a coroutine function,
+        #   which is awaited on the loop (self.loop) for up to
+        #   timeout seconds
+
+        # handlers and their info (e.g., priority) keyed
+        # by the handler's name, in execution order
+        self._table = HandlerTable()
         self.g = os.environ["GROUP"]
         self.v = os.environ["VERSION"]
         self.r = os.environ["PLURAL"]
@@ -36,114 +174,242 @@ class __Reconciler:
         self._logger = logging.getLogger(__name__)
         self._logger.setLevel(log_level)
 
-        self.skip_gen = -1
+        # opt-in parallel mode: handlers of the same priority whose
+        # view paths don't overlap are run concurrently in a pool
+        # of PARALLEL threads
+        workers = int(os.environ.get("PARALLEL", 0))
+        self._pool = ThreadPoolExecutor(max_workers=workers) \
+            if workers > 0 else None
 
-        # handler info (e.g., priority) are used to
-        # generate the self.handlers upon handler updates;
-        # each of form (fn, condition, view_path, priority, type)
-        # keyed by handler's name (fn.__name__)
-        self._handler_info = OrderedDict()
-        self._handler_info_updated = True
+        # event loop the async handlers are awaited on, i.e.,
+        # the operator's; a private one is started if unset
+        self.loop = None
+        self._loop_lock = threading.Lock()
+
+        self.skip_gen = -1
+        # last generation handled (or skipped) by the driver;
+        # events in between are coalesced by the operator
+        self.handled_gen = -1
 
         # most recent view of the model, served as an in-memory
         # read-only copy to be used in external application
         # TBD expose or get rid of it
         self._view = dict()
 
+    @property
+    def handlers(self) -> list:
+        # handlers in execution order
+        return self._table.handlers
+
     def run(self, spec, old, diff, *args, **kwargs):
+        if not metrics.enabled:
+            return self._run(spec, old, diff, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return self._run(spec, old, diff, *args, **kwargs)
+        finally:
+            metrics.observe("reconcile_latency_seconds", time.perf_counter() - start)
+
+    def _run(self, spec, old, diff, *args, **kwargs):
+        # handlers edit a copy s.t. the incoming spec is
+        # kept intact and the changes can be computed
         spec = dict(spec)
-        proc_spec = dict(spec)
+        proc_spec = copy.deepcopy(spec)
 
         self._view = spec
-        self._update_handler_info(spec, diff)
-        self._compile_handler()
+        index = filter_.DiffIndex(diff)
+        self._update_handler_info(spec, index)
+
+        # find handlers to run in one pass over the diff
+        to_run = self._table.match(index)
+        if metrics.enabled:
+            for h in self._table.handlers:
+                if h.name not in to_run:
+                    _count_skip(h)
+
+        # handlers are run one by one or, in the parallel mode,
+        # in groups of the same priority and disjoint view paths
+        group = list()
+        for h in self._table.ordered(to_run):
+            if self._can_join(group, h):
+                group.append(h)
+                continue
 
-        for fn, cond, path, _ in self.handlers:
-            if cond(proc_spec, diff, path, *args, **kwargs):
-                # handler edits the spec object
-                try:
-                    # TBD allow subview to be a forest
-                    fn(subview=safe_lookup(proc_spec, path),
-                       proc_view=proc_spec,
-                       view=spec, old_view=old,
-                       mount=proc_spec.get("mount", {}),
-                       obs=proc_spec.get("obs", {}),
-                       back_prop=get_back_prop(diff),
-                       diff=diff,
-                       )
-                except Exception as e:
-                    self._logger.error(f"reconcile error: {e}")
-                    self._logger.error(traceback.format_exc())
-                    # TBD: expose driver status on model, e.g., obs.reason/or some debug attribute
-                    return proc_spec
+            if not self._run_group(group, proc_spec, spec, old, diff, index):
+                return proc_spec
 
+            group = list()
+            if h.condition is filter_.has_diff or \
+                    any(h.condition(proc_spec, diff, p, *args,
+                                    diff_index=index, **kwargs)
+                        for p in h.paths):
+                group.append(h)
+            elif metrics.enabled:
+                _count_skip(h)
+
+        self._run_group(group, proc_spec, spec, old, diff, index)
         return proc_spec
 
+    def _can_join(self, group: list, h: Handler) -> bool:
+        if len(group) == 0:
+            return False
+
+        first = group[0]
+        if h.condition is not filter_.has_diff or \
+                first.condition is not filter_.has_diff or \
+                h.priority != first.priority:
+            return False
+        # async handlers overlap on the loop w/o the pool
+        if self._pool is None and not (
+                h.is_async and all(j.is_async for j in group)):
+            return False
+        return not any(_overlap(p, q) for j in group
+                       for p in h.paths for q in j.paths)
+
+    def _run_group(self, group: list, proc_spec, spec, old,
+                   diff, index) -> bool:
+        if len(group) == 0:
+            return True
+
+        if len(group) == 1:
+            h = group[0]
+            start = time.perf_counter() if metrics.enabled else 0
+            try:
+                # handler edits the spec object
+                if h.is_async:
+                    self._submit(_call(h.fn, h.paths, proc_spec, spec,
+                                       old, diff, index),
+                                 h.timeout).result()
+                else:
+                    _call(h.fn, h.paths, proc_spec, spec, old, diff, index)
+            except Exception as e:
+                self._log_error(h.name, e)
+                # TBD: expose driver status on model, e.g., obs.reason/or some debug attribute
+                return False
+            finally:
+                if metrics.enabled:
+                    _count_call(h, start)
+            return True
+
+        # each handler edits its own copy of the spec; the
+        # changes are merged back in the execution order
+        futures = list()
+        for h in group:
+            if h.is_async:
+                f = self._submit(_call_on_copy_async(h.fn, h.paths,
+                                                     proc_spec, spec, old,
+                                                     diff, index),
+                                 h.timeout)
+            else:
+                f = self._pool.submit(_call_on_copy, h.fn, h.paths,
+                                      proc_spec, spec, old, diff, index)
+            if metrics.enabled:
+                f.add_done_callback(lambda _, h=h, start=time.perf_counter():
+                                    _count_call(h, start))
+            futures.append(f)
+
+        patches = list()
+        for h, f in zip(group, futures):
+            name = h.name
+            try:
+                patches.append((name, util.merge_patch(proc_spec, f.result())))
+            except Exception as e:
+                self._log_error(name, e)
+                # keep the changes of the handlers prior to the failed
+                # one as if the handlers were run one by one
+                _merge_patches(patches, proc_spec, self._logger)
+                return False
+
+        _merge_patches(patches, proc_spec, self._logger)
+        return True
+
+    def _submit(self, coro, timeout=None) -> Future:
+        # the coroutine is cancelled on timeout
+        if self.loop is None:
+            with self._loop_lock:
+                if self.loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever,
+                                     daemon=True).start()
+                    self.loop = loop
+        return asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(coro, timeout), self.loop)
+
+    def _log_error(self, name, e):
+        self._logger.error(f"reconcile error in {name}: {e}")
+        self._logger.error(traceback.format_exc())
+
     def add(self, handler: typing.Callable,
             condition: typing.Callable,
             priority: int,
             path: tuple = (),
-            typ=HandlerType.BUILTIN):
+            typ=HandlerType.BUILTIN,
+            name: str = None,
+            timeout: float = None):
 
-        n = handler.__name__
+        n = handler.__name__ if name is None else name
 
-        if n in self._handler_info:
-            # TBD perhaps use deterministic name
-            n = n + util.uuid_str()
-
-        self._handler_info[n] = {
+        return self._table.insert(n, {
             "fn": handler,
             "condition": condition,
-            "view_path": path,
+            "view_paths": (path,),
             "priority": priority,
             "type": typ,
-        }
+            "timeout": timeout,
+        })[0]
+
+    def subscribe(self, name: str, path: tuple, priority: int):
+        # subscribe an added handler to one more path; the
+        # handler takes the highest priority of its paths
+        info = self._table.get(name)
+        if path in info["view_paths"]:
+            return
+        self._table.update(name,
+                           view_paths=info["view_paths"] + (path,),
+                           priority=max(info["priority"], priority))
 
-    def _update_handler_info(self, spec, diff):
+    def _update_handler_info(self, spec, index: filter_.DiffIndex) -> list:
         # check whether there is a reflex change
-        _changed = not all(len(_path) < 2 or _path[1] != "reflex"
-                           for _, _path, _, _ in diff)
-
-        if _changed:
-            reflexes = util.deep_get(spec, "reflex", {})
-
-            # trim reflexes
-            to_remove = list()
-            for n, info in self._handler_info.items():
-                if info["type"] == HandlerType.BUILTIN:
-                    continue
-                if n not in reflexes:
-                    to_remove.append(n)
-
-            for n in to_remove:
-                self._handler_info.pop(n, {})
-
-            # update handlers
-            for n, r in reflexes.items():
-                info = self._handler_info.get(n, {
-                    "fn": do_nothing,
+        if not index.reflex_changed:
+            return []
+
+        reflexes = util.deep_get(spec, "reflex", {}) or {}
+        table, changed = self._table, list()
+
+        # trim reflexes
+        for n in table.names(HandlerType.REFLEX):
+            if n not in reflexes:
+                changed += table.remove(n)
+
+        # update handlers; only new or edited policies are compiled
+        for n, r in reflexes.items():
+            source = r.get("policy", None), r.get("processor", "py")
+            prio = r.get("priority", 0)
+
+            info = table.get(n)
+            if info is None:
+                changed += table.insert(n, {
+                    "fn": self._new_reflex(*source),
                     "condition": filter_.always,  # TBD conditioned reflex
-                    "view_path": ".",
-                    "priority": 0,
+                    "view_paths": ((".",),),
+                    "priority": prio,
                     "type": HandlerType.REFLEX,
+                    "timeout": None,
+                    "source": source,
                 })
-
-                patch = dict()
-                if "policy" in r:
-                    patch.update({
-                        "fn": self._new_reflex(r["policy"],
-                                               r.get("processor", "py"))
-                    })
-
-                if "priority" in r:
-                    patch.update({
-                        "priority": r["priority"]
-                    })
-
-                info.update(patch)
-                self._handler_info[n] = info
-
-            self._handler_info_updated = True
+            elif info["type"] != HandlerType.REFLEX:
+                self._logger.warning(f"reflex {n} conflicts with a handler")
+            elif info["source"] != source:
+                changed += table.update(n, fn=self._new_reflex(*source),
+                                        source=source, priority=prio)
+            else:
+                changed += table.reprioritize(n, prio)
+
+        if len(changed) > 0:
+            self._logger.info(f"Updated reflexes {changed} "
+                              f"(handler table version {table.version})")
+        return changed
 
     @staticmethod
     def _new_reflex(logic, proc="py"):
@@ -155,21 +421,93 @@ class __Reconciler:
             return processor.jq(logic)
         ...
 
-    def _compile_handler(self):
-        if not self._handler_info_updated:
-            return
 
-        self.handlers = list()
-        for _, hi in self._handler_info.items():
-            # treat negative priority as disabled
-            if hi["priority"] < 0:
-                continue
-            self.handlers.append((hi["fn"], hi["condition"],
-                                  hi["view_path"], hi["priority"]))
+def _call(fn, paths, proc_spec, spec, old, diff, index):
+    # returns a coroutine for the async handlers
+    return fn(subview=_subview(proc_spec, paths),
+              proc_view=proc_spec,
+              view=spec, old_view=old,
+              mount=proc_spec.get("mount", {}),
+              obs=proc_spec.get("obs", {}),
+              back_prop=index.back_prop,
+              diff=diff,
+              diff_index=index,
+              )
+
+
+def _call_on_copy(fn, paths, proc_spec, *args):
+    proc_spec = copy.deepcopy(proc_spec)
+    _call(fn, paths, proc_spec, *args)
+    return proc_spec
+
+
+async def _call_on_copy_async(fn, paths, proc_spec, *args):
+    proc_spec = copy.deepcopy(proc_spec)
+    await _call(fn, paths, proc_spec, *args)
+    return proc_spec
+
+
+def _count_call(h: Handler, start: float):
+    path = _path_label(h)
+    metrics.inc("handler_calls", handler=h.name, path=path)
+    metrics.observe("handler_latency_seconds", time.perf_counter() - start,
+                    handler=h.name, path=path)
+
+
+def _count_skip(h: Handler):
+    metrics.inc("handler_skips", handler=h.name, path=_path_label(h))
+
+
+def _path_label(h: Handler) -> str:
+    return ",".join(".".join(p) for p in h.paths)
 
-        # sort by priority
-        self.handlers = sorted(self.handlers, key=lambda x: x[3])
-        self._handler_info_updated = False
+
+def _merge_patches(patches: list, proc_spec: dict, logger):
+    # apply the patches in order; a later patch overwrites
+    # the conflicting paths written by the earlier ones
+    written = dict()
+    for name, patch in patches:
+        for p in util.leaf_paths(patch):
+            for q, other in written.items():
+                if _overlap(p, q):
+                    logger.warning(f"conflicting writes to {'.'.join(p)} "
+                                   f"by {other} and {name}; {name} wins")
+                    break
+        for p in util.leaf_paths(patch):
+            written[p] = name
+        util.apply_merge_patch(proc_spec, patch)
+
+
+def _overlap(a: tuple, b: tuple) -> bool:
+    # whether one of the subtrees contains the other
+    if a == (".",) or b == (".",):
+        return True
+    n = min(len(a), len(b))
+    return a[:n] == b[:n]
+
+
+def _subview(d: dict, paths: tuple):
+    if len(paths) == 1:
+        return safe_lookup(d, paths[0])
+
+    # a forest of the subtrees, i.e., a projection of the view
+    # to the paths whose leaves are the subtrees themselves so
+    # that writes to them go to the view
+    if (".",) in paths:
+        return d
+
+    forest = dict()
+    paths = sorted(paths, key=len)
+    for i, p in enumerate(paths):
+        # skip the subtrees contained by other ones
+        if any(q == p[:len(q)] for q in paths[:i]):
+            continue
+
+        node = forest
+        for k in p[:-1]:
+            node = node.setdefault(k, {})
+        node[p[-1]] = safe_lookup(d, p)
+    return forest
 
 
 def safe_lookup(d: dict, path: tuple):
@@ -186,18 +524,9 @@ def do_nothing(*args, **kwargs):
 
 
 def get_back_prop(diff):
-    bp = list()
-    for op, path, old, new in diff:
-        if op != "change" and op != "add":
-            continue
-        if len(path) < 3 or path[0] != "spec" \
-                or path[1] != "mount":
-            continue
+    return [(op, path, old, new)
+            for op, path, old, new in diff
+            if filter_.is_back_prop(op, path)]
 
-        fs = set(path)
-        if "intent" not in fs and "input" not in fs:
-            continue
-        bp.append((op, path, old, new))
-    return bp
 
 rc = __Reconciler()
@@ -0,0 +1,97 @@
+import os
+import sys
+import asyncio
+import threading
+
+_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_dir)
+sys.path.insert(0, _parent_dir)
+
+import kubernetes
+from aiohttp import web
+from kubernetes.client.rest import ApiException
+
+from digi.client import Client
+
+model = ("mock.digi.dev", "v1", "rooms", "room", "default")
+_path = "/apis/{g}/{v}/namespaces/{ns}/{r}/{n}"
+
+
+def _serve() -> str:
+    state = {"spec": {"a": 1},
+             "metadata": {"resourceVersion": "1", "generation": 1}}
+
+    async def get(req):
+        if req.match_info["n"] == "broken":
+            return web.Response(status=503, text="upstream unavailable")
+        return web.json_response(state)
+
+    async def patch(req):
+        body = await req.json()
+        state["spec"].update(body["spec"])
+        return web.json_response(state)
+
+    app = web.Application()
+    app.router.add_get(_path, get)
+    app.router.add_patch(_path, patch)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    port = site._server.sockets[0].getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def _client(host) -> Client:
+    conf = kubernetes.client.Configuration()
+    conf.host = host
+    kubernetes.client.Configuration.set_default(conf)
+    return Client()
+
+
+def test():
+    """The async methods awaited on foreign loops and the sync
+    facade share the client's loop and pool in any order."""
+    conf = kubernetes.client.Configuration.get_default_copy()
+    try:
+        _test(_serve())
+    finally:
+        kubernetes.client.Configuration.set_default(conf)
+
+
+def _test(host):
+    c = _client(host)
+    assert asyncio.run(c.get(*model))["spec"] == {"a": 1}
+    assert c.get_sync(*model)["metadata"]["generation"] == 1
+    c.close()
+
+    c = _client(host)
+    assert c.patch_sync(*model, {"spec": {"b": 2}})["spec"]["b"] == 2
+    assert asyncio.run(c.get(*model))["spec"] == {"a": 1, "b": 2}
+    assert asyncio.run(c.patch(*model, {"spec": {"b": 3}}))["spec"]["b"] == 3
+
+    # error responses w/o a JSON body are raised as ApiException
+    for fn in [lambda: c.get_sync(*model[:3], "broken", "default"),
+               lambda: asyncio.run(c.get(*model[:3], "broken", "default"))]:
+        try:
+            fn()
+            assert False, "expected an ApiException"
+        except ApiException as e:
+            assert e.status == 503 and e.body == "upstream unavailable"
+
+    # the semaphores of idle models are dropped
+    async def _burst():
+        return await asyncio.gather(*[c.get(*model[:3], f"room-{i}", "default")
+                                      for i in range(20)])
+    assert len(asyncio.run(_burst())) == 20
+    assert len(c._sems) == 0
+    c.close()
+
+
+if __name__ == '__main__':
+    test()
+    print("ok")
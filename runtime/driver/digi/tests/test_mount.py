@@ -108,6 +108,37 @@ def test_all():
     # test_prop(s.parent, s.child)
 
 
+def test_batcher():
+    """Concurrent child updates are merged into fewer parent
+    writes, keeping the latest generation per child."""
+    import threading
+    from digi.mount import PatchBatcher
+
+    writes = list()
+
+    def _write(entries):
+        _wait(0.05)
+        writes.append(entries)
+
+    b = PatchBatcher(_write)
+    ts = [threading.Thread(target=b.submit,
+                           args=(("lamps", f"l{i % 4}"), {"gen": i}),
+                           kwargs={"gen": i})
+          for i in range(16)]
+    for t in ts:
+        t.start()
+        _wait(0.005)
+    for t in ts:
+        t.join()
+
+    assert 1 < len(writes) < 16, writes
+    latest = dict()
+    for w in writes:
+        latest.update(w)
+    assert {k: e["gen"] for k, e in latest.items()} == \
+           {("lamps", f"l{i}"): 12 + i for i in range(4)}
+
+
 def _get_spec(m):
     return util.get_spec(m["g"], m["v"], m["r"],
                          m["n"], m["ns"])
@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import pprint as pp
+
+_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_dir)
+sys.path.insert(0, _parent_dir)
+
+os.environ.update({
+    "GROUP": "mock.digi.dev",
+    "VERSION": "v1",
+    "PLURAL": "rooms",
+    "NAME": "room",
+    "NAMESPACE": "default",
+})
+
+import digi.on as on
+import digi.filter as filter_
+from digi.reconcile import rc, _call
+
+test_view = {
+    "control": {
+        "brightness": {"intent": 0.8, "status": 0},
+        "mode": {"intent": "sleep", "status": "sleep"},
+    },
+    "mount": {},
+    "obs": {},
+}
+test_diff = [("change", ("spec", "control", "brightness", "intent"), 0, 0.8)]
+
+
+def _dict_bind(fn, kwarg_filter):
+    # the per-call binding the decorators used to generate
+    def wrapper_fn(*args, **kwargs):
+        fn(**_bind(*args, **kwargs))
+
+    def _bind(subview, proc_view, view,
+              old_view, mount, obs, back_prop,
+              diff, diff_index):
+        kwargs = dict()
+        for _k, _v in [("subview", subview),
+                       ("proc_view", proc_view),
+                       ("view", view),
+                       ("old_view", old_view),
+                       ("mount", mount),
+                       ("obs", obs),
+                       ("back_prop", back_prop),
+                       ("diff", diff),
+                       ("diff_index", diff_index),
+                       ("typ", None),
+                       ]:
+            if _k in kwarg_filter:
+                kwargs[kwarg_filter[_k]] = _v
+        return kwargs
+
+    return wrapper_fn
+
+
+def test():
+    @on.control
+    @on.mount
+    def h(sv, mounts):
+        for _, v in sv["control"].items():
+            v["status"] = v["intent"]
+
+    h_ = rc.handlers[-1]
+    assert h_.fn.__name__ == "wrapper_fn" and len(h_.paths) == 2
+
+    _call(h_.fn, h_.paths, test_view, test_view, {},
+          test_diff, filter_.DiffIndex(test_diff))
+    assert test_view["control"]["brightness"]["status"] == 0.8
+    print("ok")
+
+
+def test_no_path():
+    """Parameterized decorators w/o a path subscribe to the
+    whole attribute."""
+    @on.obs(prio=2, timeout=0.2)
+    def h_obs(sv):
+        sv["reason"] = "ok"
+
+    h_ = rc.handlers[-1]
+    assert h_.name == "h_obs" and h_.paths == (("obs",),)
+    assert h_.priority == 2 and h_.timeout == 0.2
+
+    view = {"obs": {}}
+    _call(h_.fn, h_.paths, view, view, {}, [], filter_.DiffIndex([]))
+    assert view["obs"]["reason"] == "ok"
+
+
+def bench_dispatch(k=100000):
+    """Per-handler dispatch cost, i.e., calling a no-op
+    handler through its binding, in microseconds."""
+
+    def h(sv, pv, mounts):
+        _, _, _ = sv, pv, mounts
+
+    kwarg_filter = {"subview": "sv", "proc_view": "pv", "mount": "mounts"}
+    index = filter_.DiffIndex(test_diff)
+
+    result = dict()
+    for name, fn in [("dict", _dict_bind(h, kwarg_filter)),
+                     ("compiled", on._compile(h, kwarg_filter,
+                                              {"fn": h, "typ": None}))]:
+        start = time.perf_counter()
+        for _ in range(k):
+            _call(fn, (("control",),), test_view, test_view, {},
+                  test_diff, index)
+        result[name] = (time.perf_counter() - start) / k * 1e6
+    return result
+
+
+if __name__ == '__main__':
+    test()
+    test_no_path()
+    print("per-handler dispatch cost (us):")
+    pp.pprint(bench_dispatch())
@@ -1,4 +1,5 @@
 import time
+import copy
 import yaml
 import os
 import sys
@@ -8,7 +9,9 @@ _dir = os.path.dirname(os.path.realpath(__file__))
 _parent_dir = os.path.dirname(_dir)
 sys.path.insert(0, _parent_dir)
 
-from digi.processor import jq
+import pyjq
+from digi.processor import jq, py
+from digi.view import ModelView
 
 test_yaml = f"""
 control:
@@ -37,9 +40,79 @@ reflex:
     priority: 1
 """
 
+
+def test_jq():
+    v = yaml.load(test_yaml, Loader=yaml.FullLoader)
+    lamp = copy.deepcopy(v["mount"]["mock.digi.dev/v1/lamps"])
+
+    # models omitted in the output are left untouched
+    jq('{root: (.root | .control.mode.intent = "work" '
+       '| del(.control.brightness.status))}')(v)
+    assert v["control"]["mode"]["intent"] == "work"
+    # deleted as None, i.e., removed by the merge patch
+    assert v["control"]["brightness"] == {"intent": 0.8, "status": None}
+    assert v["mount"]["mock.digi.dev/v1/lamps"] == lamp
+
+    jq(v["reflex"]["motion-mode"]["policy"])(v)
+    assert v["control"]["mode"]["intent"] == "work"
+    assert v["mount"]["mock.digi.dev/v1/lamps"] == lamp
+
+
+def test_py_budget():
+    # runaway policies are interrupted within the budget
+    for policy in ["while True: pass",
+                   "x = 0\nwhile True: x += 1"]:
+        start = time.time()
+        try:
+            py(policy, budget=0.05)({"control": {}})
+            assert False, "expected a TimeoutError"
+        except TimeoutError:
+            pass
+        assert time.time() - start < 1, policy
+
+    v = {"control": {"mode": {"intent": "work"}}}
+    py("root.control.mode.status = root.control.mode.intent",
+       budget=0.05)(v)
+    assert v["control"]["mode"]["status"] == "work"
+
+
+def _uncached_jq(policy: str):
+    # the processor before the program cache: the macro is
+    # substituted once and the program compiled per evaluation
+    policy = policy.replace("$time", str(time.time()))
+
+    def fn(proc_view, *args, **kwargs):
+        _, _ = args, kwargs
+        with ModelView(proc_view) as mv:
+            mv.update(pyjq.one(policy, mv.to_dict()))
+
+    return fn
+
+
+def bench_reflexes(num_reflex=20, k=100):
+    """Per-reflex cost on a room with num_reflex reflexes."""
+    v = yaml.load(test_yaml, Loader=yaml.FullLoader)
+    policy = v["reflex"]["motion-mode"]["policy"]
+    policies = [policy.replace("600", str(600 + i))
+                for i in range(num_reflex)]
+
+    result = dict()
+    for name, proc in [("uncached", _uncached_jq), ("cached", jq)]:
+        fns = [proc(p) for p in policies]
+        start = time.time()
+        for _ in range(k):
+            for fn in fns:
+                fn(v)
+        result[name] = (time.time() - start) / k / num_reflex
+    return result
+
+
 if __name__ == '__main__':
     v = yaml.load(test_yaml, Loader=yaml.FullLoader)
     start = time.time()
     jq(v["reflex"]["motion-mode"]["policy"])(v)
     print(f"took {time.time() - start}s")
     pp.pprint(v)
+
+    print("per-reflex cost (s) with 20 reflexes:")
+    pp.pprint(bench_reflexes())
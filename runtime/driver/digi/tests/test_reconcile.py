@@ -0,0 +1,183 @@
+import os
+import sys
+import logging
+
+_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_dir)
+sys.path.insert(0, _parent_dir)
+
+os.environ.update({
+    "GROUP": "mock.digi.dev",
+    "VERSION": "v1",
+    "PLURAL": "rooms",
+    "NAME": "room",
+    "NAMESPACE": "default",
+})
+
+import digi.filter as filter_
+from digi.reconcile import rc, HandlerTable
+
+test_spec = {
+    "control": {
+        "a": {"intent": 1, "status": 0},
+        "b": {"intent": 1, "status": 0},
+        "c": {"intent": 1, "status": 0},
+    },
+    "obs": {},
+}
+test_diff = [("change", ("spec", "control", k, "intent"), 0, 1)
+             for k in ("a", "b", "c")]
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = list()
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+
+def _parallel_rc():
+    os.environ["PARALLEL"] = "4"
+    try:
+        return type(rc)()
+    finally:
+        os.environ.pop("PARALLEL")
+
+
+def _handler(k, obs=None, fail=False):
+    def fn(subview, proc_view, **_):
+        subview["status"] = subview["intent"]
+        if obs is not None:
+            proc_view["obs"]["last"] = obs
+        if fail:
+            raise ValueError(f"{k} failed")
+
+    fn.__name__ = k
+    return fn
+
+
+def test_parallel_merge():
+    """Handlers of the same priority on disjoint paths run as
+    one group; their changes are merged in the execution order
+    and the conflicting writes are reported."""
+    r = _parallel_rc()
+    for k, obs in [("a", "a"), ("b", "b"), ("c", None)]:
+        r.add(_handler(k, obs=obs), filter_.has_diff, 0,
+              path=("control", k))
+
+    records = _Records()
+    r._logger.addHandler(records)
+    try:
+        result = r.run(test_spec, test_spec, test_diff)
+    finally:
+        r._logger.removeHandler(records)
+
+    assert all(result["control"][k]["status"] == 1 for k in "abc")
+    # b runs after a and wins the conflict
+    assert result["obs"] == {"last": "b"}
+    assert any("obs.last by a and b; b wins" in m
+               for m in records.records), records.records
+    # the incoming spec is intact
+    assert test_spec["control"]["a"]["status"] == 0
+
+
+def test_parallel_failure():
+    """The changes are kept only up to the failed handler, as
+    if the handlers were run one by one."""
+    r = _parallel_rc()
+    r.add(_handler("a"), filter_.has_diff, 0, path=("control", "a"))
+    r.add(_handler("b", fail=True), filter_.has_diff, 0,
+          path=("control", "b"))
+    r.add(_handler("c"), filter_.has_diff, 0, path=("control", "c"))
+
+    result = r.run(test_spec, test_spec, test_diff)
+    assert result["control"]["a"]["status"] == 1
+    assert result["control"]["b"]["status"] == 0
+    assert result["control"]["c"]["status"] == 0
+
+
+def _run_with_reflex(policy, processor):
+    r = type(rc)()
+    r.add(_handler("a"), filter_.has_diff, 0, path=("control", "a"))
+
+    spec = dict(test_spec, reflex={
+        "bad": {"policy": policy, "processor": processor},
+    })
+    return r.run(spec, {}, [("add", (), None, {"spec": spec})])
+
+
+def test_invalid_reflex():
+    """A reflex that fails to compile is skipped and the other
+    handlers still run."""
+    for policy, processor in [(".root | (((", "jq"),
+                              ("root.control.a.status = (", "py"),
+                              ("x = root.__class__", "py")]:
+        result = _run_with_reflex(policy, processor)
+        assert result["control"]["a"]["status"] == 1, policy
+
+
+def _info(fn_name, priority=0, path=("control",),
+          condition=filter_.has_diff):
+    return {
+        "fn": _handler(fn_name),
+        "condition": condition,
+        "view_paths": (path,),
+        "priority": priority,
+        "type": 1,
+        "timeout": None,
+    }
+
+
+def _names(t: HandlerTable) -> list:
+    return [h.name for h in t.handlers]
+
+
+def test_table():
+    """Insert, remove, reprioritize and update keep the order by
+    (priority, insertion), the trie and the version in place."""
+    t = HandlerTable()
+    assert t.insert("a", _info("a", path=("control", "a"))) == ["a"]
+    assert t.insert("b", _info("b", priority=-1)) == ["b"]
+    assert t.insert("c", _info("c", condition=filter_.always)) == ["c"]
+    assert t.version == 3
+
+    # negative priority disables the handler
+    assert _names(t) == ["a", "c"] and len(t) == 2 and "b" in t
+
+    # a clashing name is made unique
+    d = t.insert("a", _info("a"))[0]
+    assert d != "a" and d.startswith("a") and _names(t) == ["a", "c", d]
+
+    index = filter_.DiffIndex([("change", ("spec", "control", "a", "intent"), 0, 1)])
+    assert t.match(index) == {"a", "c", d}
+    assert [h.name for h in t.ordered({"c", "a"})] == ["a", "c"]
+
+    assert t.reprioritize("b", 1) == ["b"]
+    assert _names(t) == ["a", "c", d, "b"]
+    assert t.reprioritize("a", 2) == ["a"]
+    assert _names(t) == ["c", d, "b", "a"]
+
+    # no-op updates keep the version; unknown keys are patched
+    version = t.version
+    assert t.reprioritize("a", 2) == [] and t.version == version
+    assert t.update("a", source=("p", "py")) == ["a"]
+    assert t.get("a")["source"] == ("p", "py") and t.version == version + 1
+
+    # the view paths are re-indexed
+    t.update("a", view_paths=(("obs",),))
+    assert "a" not in t.match(index)
+
+    assert t.remove("a") == ["a"] and t.remove("a") == []
+    assert "a" not in t and _names(t) == ["c", d, "b"]
+    assert t.reprioritize("b", -1) == ["b"] and _names(t) == ["c", d]
+    assert t.match(index) == {"c", d}
+
+
+if __name__ == '__main__':
+    test_parallel_merge()
+    test_parallel_failure()
+    test_invalid_reflex()
+    test_table()
+    print("ok")
@@ -0,0 +1,140 @@
+import os
+import sys
+import copy
+import time
+import random
+import pprint as pp
+from functools import reduce
+from collections.abc import Iterable
+
+_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_dir)
+sys.path.insert(0, _parent_dir)
+
+from digi.util import deep_get, deep_set, put, path
+
+test_view = {
+    "control": {
+        "brightness": {"intent": 0.8, "status": 0},
+        "mode": {"intent": "sleep", "status": "sleep"},
+        "power": {"intent": "on"},
+    },
+    "obs": {"reason": None},
+}
+test_paths = ["control.brightness.intent", "control.mode", "control.x.y",
+              "obs.reason.x", "control", "x", ("control", "power", "intent"),
+              (), []]
+
+
+# the helpers before the compiled paths
+def _deep_get(d, path, default=None):
+    return reduce(lambda _d, key: _d.get(key, default) if isinstance(_d, dict) else default,
+                  path.split(".") if isinstance(path, str) else path, d)
+
+
+def _deep_set(d, path, val, create=False):
+    if not isinstance(d, dict):
+        return
+    if isinstance(path, str):
+        keys = path.split(".")
+    elif isinstance(d, Iterable):
+        keys = path
+    else:
+        return
+    for k in keys[:-1]:
+        if k not in d:
+            if create:
+                d[k] = {}
+            else:
+                return
+        d = d[k]
+    d[keys[-1]] = val
+
+
+def _put(path, src, target, transform=lambda x: x):
+    if not isinstance(target, dict):
+        return
+
+    ps = path.split(".")
+    for p in ps[:-1]:
+        if p not in target:
+            return
+        target = target[p]
+
+    if not isinstance(src, dict):
+        if src is None:
+            target[ps[-1]] = None
+        else:
+            target[ps[-1]] = transform(src)
+        return
+
+    for p in ps[:-1]:
+        if p not in src:
+            return
+        src = src[p]
+    target[ps[-1]] = transform(src[ps[-1]])
+
+
+def _run(fn, *args, target=False, **kwargs):
+    # the resulting view or the error raised
+    v = copy.deepcopy(test_view)
+    try:
+        if target:
+            fn(args[0], args[1], v, **kwargs)
+        else:
+            fn(v, *args, **kwargs)
+    except Exception as e:
+        return type(e)
+    return v
+
+
+def test():
+    for p in test_paths:
+        for default in [None, {}]:
+            assert deep_get(test_view, p, default) == \
+                   _deep_get(test_view, p, default), p
+
+        for create in [False, True]:
+            assert _run(deep_set, p, 1, create=create) == \
+                   _run(_deep_set, p, 1, create=create), p
+
+        if isinstance(p, str):
+            assert _run(put, p, test_view, transform=str, target=True) == \
+                   _run(_put, p, test_view, transform=str, target=True), p
+
+    assert path("control.mode") is path("control.mode")
+    assert path("control.mode").exists(test_view)
+    assert not path("control.x.y").exists(test_view)
+    print("ok")
+
+
+def bench_paths(k=100000):
+    """Per-call cost of the path helpers in microseconds."""
+    p = "control.brightness.intent"
+    v = copy.deepcopy(test_view)
+
+    result = dict()
+    for name, get, set_ in [("reduce", _deep_get, _deep_set),
+                            ("compiled", deep_get, deep_set)]:
+        start = time.perf_counter()
+        for _ in range(k):
+            get(v, p)
+        result[f"{name}_get"] = (time.perf_counter() - start) / k * 1e6
+
+        start = time.perf_counter()
+        for _ in range(k):
+            set_(v, p, random.random())
+        result[f"{name}_set"] = (time.perf_counter() - start) / k * 1e6
+
+    accessor = path(p)
+    start = time.perf_counter()
+    for _ in range(k):
+        accessor.get(v)
+    result["accessor_get"] = (time.perf_counter() - start) / k * 1e6
+    return result
+
+
+if __name__ == '__main__':
+    test()
+    print("per-call cost (us):")
+    pp.pprint(bench_paths())
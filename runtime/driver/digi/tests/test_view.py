@@ -3,10 +3,16 @@ import yaml
 import copy
 import pprint as pp
 
+from digi.util import deep_get
 from digi.view import (
     ModelView,
     TypeView,
     DotView,
+    MountView,
+    ColumnView,
+    np,
+    _paths_of,
+    _project,
 )
 
 
@@ -60,5 +66,217 @@ def test():
     print(f"-----\nafter: {v}\n")
 
 
+def _tracked_view():
+    return {
+        "control": {
+            "brightness": {"intent": 0.8, "status": 0},
+            "mode": {"intent": "sleep", "status": "sleep"},
+        },
+        "tags": ["a", "b"],
+        "obs": {},
+        "mount": {
+            "mock.digi.dev/v1/lamps": {
+                "default/lamp-test": {"spec": {
+                    "control": {"power": {"intent": "on"}},
+                }},
+            },
+        },
+    }
+
+
+def test_tracked_dict():
+    # nested write after a parent overwrite
+    v = _tracked_view()
+    with ModelView(v) as mv:
+        mv["root"]["control"] = {"power": {"intent": "on"}}
+        mv["root"]["control"]["power"]["intent"] = "off"
+        mv["lamp-test"]["control"]["power"] = {"intent": "off"}
+        mv["lamp-test"]["control"]["power"]["status"] = "off"
+    assert v["control"] == {"power": {"intent": "off"}}
+    assert deep_get(v, ["mount", "mock.digi.dev/v1/lamps", "default/lamp-test",
+                        "spec", "control", "power"]) == \
+           {"intent": "off", "status": "off"}
+
+    # in-place list mutation; reads alone are not written
+    v = _tracked_view()
+    with ModelView(v) as mv:
+        mv["root"]["tags"].append("c")
+        _ = mv["lamp-test"]["control"]["power"]["intent"]
+        assert mv.changes() == [(("root", "tags"), ["a", "b", "c"])]
+    assert v["tags"] == ["a", "b", "c"]
+
+    # deletes are written as None, i.e., removed by a merge patch
+    v = _tracked_view()
+    with ModelView(v) as mv:
+        del mv["root"]["control"]["mode"]
+        assert "mode" not in mv["root"]["control"]
+        assert list(mv["root"]["control"]) == ["brightness"]
+        del mv["lamp-test"]["control"]["power"]
+    assert v["control"]["mode"] is None
+    assert deep_get(v, ["mount", "mock.digi.dev/v1/lamps", "default/lamp-test",
+                        "spec", "control", "power"], "") is None
+
+    # setdefault and update through the proxy
+    v = _tracked_view()
+    with ModelView(v) as mv:
+        assert mv["root"]["obs"].setdefault("reason", "ok") == "ok"
+        assert mv["root"]["obs"].setdefault("reason", "no") == "ok"
+        mv["root"]["control"].update({"mode": {"intent": "work"}, "fan": 1})
+    assert v["obs"] == {"reason": "ok"}
+    assert v["control"]["mode"] == {"intent": "work"}
+    assert v["control"]["fan"] == 1
+    assert v["control"]["brightness"] == {"intent": 0.8, "status": 0}
+
+    # whole-type writes in the type view
+    v = _tracked_view()
+    with TypeView(v) as tv:
+        tv["lamps"] = {"lamp-test": {"control": {"power": {"intent": "off"}}}}
+    assert deep_get(v, ["mount", "mock.digi.dev/v1/lamps", "default/lamp-test",
+                        "spec", "control", "power", "intent"]) == "off"
+    assert v["control"] == _tracked_view()["control"]
+
+
+def test_projection():
+    v = _tracked_view()
+    v["mount"]["other.dev/v1/fans"] = {
+        "default/fan-test": {"spec": {"control": {"speed": {"status": 1}}}},
+    }
+    lamps, fans = "mock.digi.dev/v1/lamps", "other.dev/v1/fans"
+
+    # short gvrs are of the parent's group and version; "*"
+    # selects all the types but not the root
+    assert _paths_of({"lamps": ["a"]}, lamps) == ["a"]
+    assert _paths_of({lamps: ["a"]}, lamps) == ["a"]
+    assert _paths_of({"fans": ["a"]}, fans) is None
+    assert _paths_of({"*": ["a"]}, fans) == ["a"]
+    assert _paths_of({"*": ["a"]}, "root") is None
+    assert _paths_of({"root": ["a"], "*": ["b"]}, "root") == ["a"]
+
+    # wildcards and missing paths
+    assert _project(v, ["control.*.status", "none.*"]) == \
+           {"control": {"brightness": {"status": 0},
+                        "mode": {"status": "sleep"}}}
+    assert _project(v, ["control.mode", "."]) is v
+    assert _project(v, ["tags"])["tags"] is v["tags"]
+
+    # the leaves are the subtrees of the source
+    proj = _project(v, ["control.brightness", "obs"])
+    assert list(proj["control"]) == ["brightness"]
+    proj["control"]["brightness"]["status"] = 0.5
+    assert v["control"]["brightness"]["status"] == 0.5
+
+    # writes through the projected views go to the source
+    v = _tracked_view()
+    v["mount"][fans] = {"default/fan-test": {"spec": {"obs": {"rpm": 1}}}}
+    with ModelView(v, projection={"root": ["control.*.status"],
+                                  lamps: ["control"]}) as mv:
+        assert set(mv) == {"root", "lamp-test"}
+        assert "intent" not in mv["root"]["control"]["mode"]
+        mv["root"]["control"]["mode"]["status"] = "work"
+        mv["lamp-test"]["control"]["power"]["status"] = "on"
+    assert v["control"]["mode"] == {"intent": "sleep", "status": "work"}
+    assert deep_get(v, ["mount", lamps, "default/lamp-test", "spec",
+                        "control", "power"]) == {"intent": "on", "status": "on"}
+
+    with TypeView(v, projection={"*": ["obs"]}) as tv:
+        assert set(tv) == {"lamps", fans}
+        assert tv["lamps"]["lamp-test"] == {}
+        tv[fans]["fan-test"]["obs"]["rpm"] = 2
+    assert deep_get(v, ["mount", fans, "default/fan-test",
+                        "spec", "obs", "rpm"]) == 2
+    assert v["control"]["mode"]["status"] == "work"
+
+
+def test_mount_view():
+    def _lamp(b):
+        return {"spec": {"control": {"brightness": {"status": b}}}}
+
+    v = {
+        "control": {"brightness": {"status": 0}},
+        "mount": {"mock.digi.dev/v1/rooms": {
+            f"default/room-{i}": {"spec": {
+                "control": {"brightness": {"status": 0}},
+                "mount": {"mock.digi.dev/v1/lamps": {
+                    f"default/lamp-{i}-{j}": _lamp(j) for j in range(3)
+                }},
+            }} for i in range(2)
+        }},
+    }
+
+    # aggregate the lamps' brightness under the rooms
+    with MountView(v) as mv:
+        assert "mount" not in mv
+        total = 0
+        for _, room in mv.mounts["rooms"].items():
+            b = sum(deep_get(lamp, "control.brightness.status")
+                    for lamp in room.mounts["lamps"].values())
+            room["control"]["brightness"]["status"] = b
+            total += b
+        mv["control"]["brightness"]["status"] = total
+
+    assert deep_get(v, "control.brightness.status") == 6
+    assert deep_get(v, ["mount", "mock.digi.dev/v1/rooms", "default/room-1",
+                        "spec", "control", "brightness", "status"]) == 3
+
+    # models keyed without the namespace
+    lamps = v["mount"]["mock.digi.dev/v1/rooms"]["default/room-0"]["spec"] \
+        ["mount"]["mock.digi.dev/v1/lamps"]
+    lamps["lamp-bare"] = _lamp(4)
+    with MountView(v) as mv:
+        room = mv.mounts["rooms"]["room-0"]
+        assert sorted(room.mounts["lamps"]) == \
+               ["lamp-0-0", "lamp-0-1", "lamp-0-2", "lamp-bare"]
+        assert sum(deep_get(lamp, "control.brightness.status")
+                   for _, lamp in room.mounts["lamps"].items()) == 7
+        room.mounts["lamps"]["lamp-bare"]["control"]["brightness"]["status"] = 5
+        assert room.mounts["lamps"]["default/lamp-0-1"] is not None
+    assert lamps["lamp-bare"]["spec"]["control"]["brightness"]["status"] == 5
+    assert "default/lamp-bare" not in lamps
+    print("mount view:", v)
+
+
+def test_column_view():
+    if np is None:
+        print("skipped column view test: numpy is not installed")
+        return
+
+    lamps = {
+        f"default/lamp-{i}": {"spec": {"control": {
+            "power": {"status": "on" if i % 2 else "off"},
+            "brightness": {"status": i},
+        }}} for i in range(4)
+    }
+    lamps["default/lamp-new"] = {}
+    v = {"mount": {"mock.digi.dev/v1/lamps": lamps}}
+
+    with ColumnView(v, "mock.digi.dev/v1/lamps",
+                    ["control.power.status",
+                     "control.brightness.status"]) as cv:
+        on = cv["control.power.status"] == "on"
+        assert list(cv.names[on]) == ["lamp-1", "lamp-3"]
+        total = cv["control.brightness.status"][on].sum()
+        cv["control.brightness.intent"][on] = total / on.sum()
+
+    assert deep_get(lamps["default/lamp-1"],
+                    "spec.control.brightness.intent") == 2
+    assert deep_get(lamps["default/lamp-0"],
+                    "spec.control.brightness.intent") is None
+
+    # int attributes are written back as ints
+    with ColumnView(v, "lamps", ["control.brightness.status"]) as cv:
+        cv["control.brightness.status"] += 1
+        cv["control.brightness.intent"][:] = 0.5
+    status = [deep_get(lamps[f"default/lamp-{i}"],
+                       "spec.control.brightness.status") for i in range(4)]
+    assert status == [1, 2, 3, 4] and all(type(s) is int for s in status)
+    assert deep_get(lamps["default/lamp-1"],
+                    "spec.control.brightness.intent") == 0.5
+    print("column view:", lamps)
+
+
 if __name__ == '__main__':
     test()
+    test_tracked_dict()
+    test_projection()
+    test_mount_view()
+    test_column_view()
@@ -1,14 +1,18 @@
 import os
+import sys
 import uuid
+import random
 import asyncio
 import contextlib
 import threading
 import inflection
 import logging
+from collections import Counter
+from collections.abc import Mapping
 from typing import (
     Tuple, Callable, Union, Any, Iterable
 )
-from functools import reduce
+from functools import lru_cache
 
 import kubernetes
 from kubernetes import config
@@ -18,6 +22,7 @@ import kopf
 from kopf.reactor.registries import SmartOperatorRegistry as KopfRegistry
 
 from digi import logger
+import digi.client as aio
 
 try:
     # use service config
@@ -33,12 +38,96 @@ class DriverError:
 
 _api = kubernetes.client.CustomObjectsApi()
 
+# number of requests sent to the apiserver, keyed by verb
+api_calls = Counter()
+
+
+class ModelCache:
+    """
+    In-process cache of the models' spec, resourceVersion
+    and generation keyed by the model id. It is kept up to
+    date by the kopf watch events (see main.run and Watch)
+    and the responses of the reads and writes in this
+    module, s.t. the conditional writes need not GET the
+    model first. The cached spec is read-only.
+    """
+
+    def __init__(self):
+        self._models = dict()
+        self._lock = threading.Lock()
+
+    def update(self, model_id_: str, body: dict):
+        meta = body.get("metadata", {})
+        rv, gen = meta.get("resourceVersion"), meta.get("generation")
+        if rv is None or gen is None:
+            return
+
+        with self._lock:
+            cur = self._models.get(model_id_, None)
+            # events may arrive after the response of a
+            # newer write; resourceVersions are opaque
+            # but in practice increasing integers
+            if cur is not None and _rv_older(rv, cur[1]):
+                return
+            self._models[model_id_] = body.get("spec", {}), rv, gen
+
+    def get(self, model_id_: str) -> (dict, str, int):
+        return self._models.get(model_id_, None)
+
+    def invalidate(self, model_id_: str):
+        with self._lock:
+            self._models.pop(model_id_, None)
+
+
+def _rv_older(a: str, b: str) -> bool:
+    try:
+        return int(a) < int(b)
+    except ValueError:
+        return False
+
+
+cache = ModelCache()
+
+
+def cache_event_fn(g, v, r, n, ns) -> Callable:
+    """Returns a kopf event handler that feeds the cache."""
+    _id = model_id(g, v, r, n, ns)
+
+    async def fn(event, **_):
+        if event.get("type") == "DELETED":
+            cache.invalidate(_id)
+        else:
+            cache.update(_id, event.get("object", {}))
+
+    return fn
+
+
+def operator(registry: KopfRegistry,
+             ready_flag: threading.Event = None,
+             stop_flag: threading.Event = None,
+             namespaces: Iterable[str] = None):
+    """
+    The kopf operator (coroutine) of the registry. The watches
+    are scoped to the namespaces if given, s.t. the operator
+    does not receive the events of the whole cluster, unless
+    the CLUSTERWIDE env is "true".
+    """
+    clusterwide = os.environ.get("CLUSTERWIDE", "false") == "true" \
+                  or not namespaces
+    return kopf.operator(
+        ready_flag=ready_flag,
+        stop_flag=stop_flag,
+        registry=registry,
+        clusterwide=clusterwide,
+        namespaces=() if clusterwide else tuple(namespaces),
+    )
+
 
 def run_operator(registry: KopfRegistry,
                  log_level=logging.INFO,
                  skip_log_setup=False,
+                 namespaces: Iterable[str] = None,
                  ) -> (threading.Event, threading.Event):
-    clusterwide = os.environ.get("CLUSTERWIDE", True)
     kopf_logging = os.environ.get("KOPFLOG", "true") == "true"
     if not kopf_logging:
         kopf_logger = logging.getLogger("kopf")
@@ -57,12 +146,10 @@ def run_operator(registry: KopfRegistry,
                 kopf.configure(verbose=log_level <= logging.DEBUG,
                                debug=log_level <= logging.DEBUG,
                                quiet=kopf_logging and log_level <= logging.INFO)
-            loop.run_until_complete(kopf.operator(
-                ready_flag=ready_flag,
-                stop_flag=stop_flag,
-                registry=registry,
-                clusterwide=clusterwide,
-            ))
+            loop.run_until_complete(operator(registry,
+                                             ready_flag=ready_flag,
+                                             stop_flag=stop_flag,
+                                             namespaces=namespaces))
 
     thread = threading.Thread(target=kopf_thread)
     thread.start()
@@ -125,6 +212,45 @@ def apply_diff(model: dict, diff: list) -> dict:
     return model
 
 
+def merge_patch(src: dict, dst: dict) -> dict:
+    """JSON merge patch (RFC 7386) that turns src into dst;
+    removed attributes are set to None."""
+    patch = dict()
+    for k, v in dst.items():
+        if k not in src:
+            patch[k] = v
+        elif isinstance(v, Mapping) and isinstance(src[k], Mapping):
+            p = merge_patch(src[k], v)
+            if len(p) > 0:
+                patch[k] = p
+        elif v != src[k]:
+            patch[k] = v
+    for k in src:
+        if k not in dst:
+            patch[k] = None
+    return patch
+
+
+def apply_merge_patch(target: dict, patch: dict) -> dict:
+    for k, v in patch.items():
+        if v is None:
+            target.pop(k, None)
+        elif isinstance(v, Mapping) and isinstance(target.get(k), Mapping):
+            apply_merge_patch(target[k], v)
+        else:
+            target[k] = v
+    return target
+
+
+def leaf_paths(patch: dict, prefix: tuple = ()) -> Iterable:
+    # attribute paths written by a merge patch
+    for k, v in patch.items():
+        if isinstance(v, Mapping) and len(v) > 0:
+            yield from leaf_paths(v, prefix + (k,))
+        else:
+            yield prefix + (k,)
+
+
 def parse_spaced_name(nsn) -> Tuple[str, str]:
     parsed = nsn.split("/")
     if len(parsed) < 2:
@@ -178,39 +304,74 @@ def parse_model_id(s) -> Tuple[str, str, str, str, str]:
     return ps[0], ps[1], ps[2], ps[4], ps[3]
 
 
-def get_spec(g, v, r, n, ns) -> (dict, str, int):
+def get_model(g, v, r, n, ns) -> dict:
     global _api
 
+    api_calls["get"] += 1
     try:
-        o = _api.get_namespaced_custom_object(group=g,
-                                              version=v,
-                                              namespace=ns,
-                                              name=n,
-                                              plural=r,
-                                              )
+        if aio.enabled:
+            o = aio.client.get_sync(g, v, r, n, ns)
+        else:
+            o = _api.get_namespaced_custom_object(group=g,
+                                                  version=v,
+                                                  namespace=ns,
+                                                  name=n,
+                                                  plural=r,
+                                                  )
     except ApiException as e:
         logger.warning(f"Unable to update model {model_id(g, v, r, n, ns)}:", e)
         return None
+    cache.update(model_id(g, v, r, n, ns), o)
+    return o
+
+
+def get_spec(g, v, r, n, ns) -> (dict, str, int):
+    o = get_model(g, v, r, n, ns)
+    if o is None:
+        return None
     return o.get("spec", {}), \
            o["metadata"]["resourceVersion"], \
            o["metadata"]["generation"]
 
 
+def get_cached_spec(g, v, r, n, ns, stale_rv=None) -> (dict, str, int):
+    # the cached (read-only) spec; GET the model on a miss or
+    # if the cache has not moved past stale_rv, e.g., the
+    # resourceVersion of a conflicted write
+    cached = cache.get(model_id(g, v, r, n, ns))
+    if cached is None or (stale_rv is not None and
+                          not _rv_older(stale_rv, cached[1])):
+        return get_spec(g, v, r, n, ns)
+    return cached
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter, in seconds."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
 def patch_spec(g, v, r, n, ns, spec: dict, rv=None):
     global _api
+
+    api_calls["patch"] += 1
+    body = {
+        "metadata": {} if rv is None else {
+            "resourceVersion": rv,
+        },
+        "spec": spec,
+    }
     try:
-        resp = _api.patch_namespaced_custom_object(group=g,
-                                                   version=v,
-                                                   namespace=ns,
-                                                   name=n,
-                                                   plural=r,
-                                                   body={
-                                                       "metadata": {} if rv is None else {
-                                                           "resourceVersion": rv,
-                                                       },
-                                                       "spec": spec,
-                                                   },
-                                                   )
+        if aio.enabled:
+            resp = aio.client.patch_sync(g, v, r, n, ns, body)
+        else:
+            resp = _api.patch_namespaced_custom_object(group=g,
+                                                       version=v,
+                                                       namespace=ns,
+                                                       name=n,
+                                                       plural=r,
+                                                       body=body,
+                                                       )
+        cache.update(model_id(g, v, r, n, ns), resp)
         return resp, None
     except ApiException as e:
         return None, e
@@ -218,9 +379,16 @@ def patch_spec(g, v, r, n, ns, spec: dict, rv=None):
 
 def check_gen_and_patch_spec(g, v, r, n, ns, spec, gen):
     # patch the spec atomically if the current gen is
-    # less than the given spec
+    # less than the given spec; use the cached resourceVersion
+    # and generation and only GET the model after a conflict
+    cached = cache.get(model_id(g, v, r, n, ns))
     while True:
-        _, rv, cur_gen = get_spec(g, v, r, n, ns)
+        if cached is None:
+            _, rv, cur_gen = get_spec(g, v, r, n, ns)
+        else:
+            _, rv, cur_gen = cached
+            cached = None
+
         if gen < cur_gen:
             e = ApiException()
             e.status = DriverError.GEN_OUTDATED
@@ -238,52 +406,113 @@ def check_gen_and_patch_spec(g, v, r, n, ns, spec, gen):
 
 
 # utils
+class Path:
+    """
+    Compiled accessor of an attribute path, e.g., Path(("control",
+    "brightness", "intent")). The keys are interned and the
+    accessors walk them without parsing; see path(). The empty
+    path gets the dict itself and cannot be set.
+    """
+    __slots__ = ("keys", "_parent", "_last")
+
+    def __init__(self, keys: tuple):
+        self.keys = tuple(sys.intern(k) if type(k) is str else k
+                          for k in keys)
+        self._parent = self.keys[:-1]
+        self._last = self.keys[-1] if len(self.keys) > 0 else None
+
+    def __repr__(self):
+        return f"Path({'.'.join(map(str, self.keys))})"
+
+    def get(self, d: dict, default=None) -> Any:
+        for k in self.keys:
+            if type(d) is not dict and not isinstance(d, Mapping):
+                return default
+            d = d.get(k, default)
+        return d
+
+    def set(self, d: dict, val: Any, create=False):
+        if type(d) is not dict and not isinstance(d, Mapping):
+            return
+        if len(self.keys) == 0:
+            raise IndexError("unable to set the empty path")
+        for k in self._parent:
+            if k not in d:
+                if create:
+                    d[k] = {}
+                else:
+                    return
+            d = d[k]
+        d[self._last] = val
+
+    def exists(self, d: dict) -> bool:
+        for k in self.keys:
+            if type(d) is not dict and not isinstance(d, Mapping) \
+                    or k not in d:
+                return False
+            d = d[k]
+        return True
+
+    def parent(self, d: dict) -> Any:
+        # the dict holding the last key; _MISSING if missing
+        for k in self._parent:
+            if k not in d:
+                return _MISSING
+            d = d[k]
+        return d
+
+
+_MISSING = object()
+
+
+@lru_cache(maxsize=int(os.environ.get("PATH_CACHE_SIZE", 1024)))
+def _compile_path(p) -> Path:
+    return Path(tuple(p.split(".")) if type(p) is str else p)
+
+
+def path(p: Union[str, Iterable, Path]) -> Path:
+    """Compiled accessor of a dotted or iterable path, e.g.,
+    path("control.brightness.intent").get(room); the same
+    path returns the same (cached) accessor."""
+    if type(p) is str or type(p) is tuple:
+        return _compile_path(p)
+    if isinstance(p, Path):
+        return p
+    return _compile_path(tuple(p))
+
+
+# the helpers below take a path argument that shadows path()
+_to_path = path
+
+
 def put(path, src, target, transform=lambda x: x):
-    if not isinstance(target, dict):
+    if not isinstance(target, Mapping):
         return
 
-    ps = path.split(".")
-    for p in ps[:-1]:
-        if p not in target:
-            return
-        target = target[p]
+    p = _to_path(path)
+    target = p.parent(target)
+    if target is _MISSING:
+        return
 
-    if not isinstance(src, dict):
+    if not isinstance(src, Mapping):
         if src is None:
-            target[ps[-1]] = None
+            target[p.keys[-1]] = None
         else:
-            target[ps[-1]] = transform(src)
+            target[p.keys[-1]] = transform(src)
         return
 
-    for p in ps[:-1]:
-        if p not in src:
-            return
-        src = src[p]
-    target[ps[-1]] = transform(src[ps[-1]])
+    src = p.parent(src)
+    if src is _MISSING:
+        return
+    target[p.keys[-1]] = transform(src[p.keys[-1]])
 
 
 def deep_get(d: dict, path: Union[str, Iterable], default=None) -> Any:
-    return reduce(lambda _d, key: _d.get(key, default) if isinstance(_d, dict) else default,
-                  path.split(".") if isinstance(path, str) else path, d)
+    return _to_path(path).get(d, default)
 
 
 def deep_set(d: dict, path: Union[str, Iterable], val: Any, create=False):
-    if not isinstance(d, dict):
-        return
-    if isinstance(path, str):
-        keys = path.split(".")
-    elif isinstance(d, Iterable):
-        keys = path
-    else:
-        return
-    for k in keys[:-1]:
-        if k not in d:
-            if create:
-                d[k] = {}
-            else:
-                return
-        d = d[k]
-    d[keys[-1]] = val
+    _to_path(path).set(d, val, create=create)
 
 
 def get_inst(d: dict, gvr_str) -> dict:
@@ -299,7 +528,7 @@ def deep_set_all(ds, path: str, val):
     if isinstance(ds, list):
         for d in ds:
             deep_set(d, path, val)
-    elif isinstance(ds, dict):
+    elif isinstance(ds, Mapping):
         for _, d in ds.items():
             deep_set(d, path, val)
 
@@ -326,7 +555,7 @@ def typ_attr_from_child_path(child_path):
 
 
 def first_attr(attr, d: dict):
-    if type(d) is not dict:
+    if not isinstance(d, Mapping):
         return None
     if attr in d:
         return d[attr]
@@ -338,7 +567,7 @@ def first_attr(attr, d: dict):
 
 
 def first_type(mounts):
-    if type(mounts) is not dict or len(mounts) == 0:
+    if not isinstance(mounts, Mapping) or len(mounts) == 0:
         return None
     return list(mounts.keys())[0]
 
@@ -1,12 +1,17 @@
 """Views used for manipulation."""
 import os
 import copy
-from box import Box
-from kopf.structs.diffs import diff
+from collections.abc import Mapping, MutableMapping, MutableSequence
 
 import digi.util as util
 from digi.util import deep_set
 
+try:
+    import numpy as np
+except ImportError:
+    # optional, used by the ColumnView
+    np = None
+
 
 class ModelView:
     """
@@ -17,44 +22,50 @@ class ModelView:
     will be skipped.
 
     The __enter__ method constructs the model view from
-    the root_view and __exit__ applies the changes back
-    to the root_view.
+    the root_view as a TrackedDict and __exit__ applies
+    the recorded writes back to the root_view.
+
+    The projection, if given, trims the view to the listed
+    gvrs and their attribute paths, e.g., {"root": ["control"],
+    "lamps": ["control.*.status"]}; see _project.
 
-    TBD: add mounts recursively but trim off each's mounts
-    TBD: add trim hint to reduce the size of view
-    TBD: support source views besides root
+    TBD: support source views besides root; see MountView
+    for the mounts of the mounted models
     """
 
-    def __init__(self, root_view: dict):
+    def __init__(self, root_view: dict, projection: dict = None):
         self._root_view = root_view
-        self._old, self._new = None, None
+        self._projection = projection
+        self._new = None
 
         self._nsn_gvr = dict()
 
     def __enter__(self):
-        _view = {"root": self._root_view}
+        _proj = self._projection
+        _view = _project_model(self._root_view, "root", _proj)
         _mount = self._root_view.get("mount", {})
 
         for typ, ms in _mount.items():
+            if _proj is not None and _paths_of(_proj, typ) is None:
+                continue
 
             for n, m in ms.items():
                 if "spec" not in m:
                     continue
                 n = n.replace("default/", "")
-                _view.update({n: m["spec"]})
+                _view.update(_project_model(m["spec"], n, _proj, typ))
                 self._nsn_gvr[n] = typ
 
-        self._old, self._new = _view, copy.deepcopy(_view)
+        self._new = TrackedDict(_view)
         return self._new
 
     def __exit__(self, typ, value, traceback):
-        # diff and apply
+        # apply the writes
         _root = self._root_view
-        _diffs = diff(self._old, self._new)
-        for op, path, old, new in _diffs:
+        for path, new in self._new.changes():
             nsn = path[0]
             if nsn == "root":
-                deep_set(_root, ".".join(path[1:]), new)
+                _set_root(_root, path[1:], new)
             else:
                 typ = self._nsn_gvr[nsn]
                 nsn = util.normalized_nsn(nsn)
@@ -71,9 +82,11 @@ class TypeView:
     TBDs: ditto
     """
 
-    def __init__(self, root_view: dict, gvr_str: str = None):
+    def __init__(self, root_view: dict, gvr_str: str = None,
+                 projection: dict = None):
         self._root_view = root_view
-        self._old, self._new = None, None
+        self._projection = projection
+        self._new = None
 
         if gvr_str is None:
             assert "GROUP" in os.environ and \
@@ -93,10 +106,14 @@ class TypeView:
 
     def __enter__(self):
         # _view = {self._r: {"root": self._root_view}}
-        _view = {"root": self._root_view}
+        _proj = self._projection
+        _view = _project_model(self._root_view, "root", _proj)
         _mount = self._root_view.get("mount", {})
 
         for typ, ms in _mount.items():
+            if _proj is not None and _paths_of(_proj, typ) is None:
+                continue
+
             _typ = typ.replace(self._gv_str + "/", "")
             _view[_typ] = {}
             self._typ_full_typ[_typ] = typ
@@ -105,19 +122,24 @@ class TypeView:
                 if "spec" not in m:
                     continue
                 n = n.replace("default/", "")
-                _view[_typ].update({n: m["spec"]})
+                _view[_typ].update(_project_model(m["spec"], n, _proj, typ))
 
-        self._old, self._new = _view, copy.deepcopy(_view)
+        self._new = TrackedDict(_view)
         return self._new
 
     def __exit__(self, typ, value, traceback):
         _root = self._root_view
-        _diffs = diff(self._old, self._new)
 
-        for op, path, old, new in _diffs:
+        for path, new in self._new.changes():
             typ = path[0]
             if typ == "root":
-                deep_set(_root, ".".join(path[1:]), new)
+                _set_root(_root, path[1:], new)
+            elif len(path) == 1:
+                # the whole type is written
+                typ = self._typ_full_typ[typ]
+                for n, m in (new or {}).items():
+                    nsn = util.normalized_nsn(n)
+                    deep_set(_root, ["mount", typ, nsn, "spec"], m)
             else:
                 typ = self._typ_full_typ[typ]
                 nsn = util.normalized_nsn(path[1])
@@ -125,8 +147,389 @@ class TypeView:
                 deep_set(_root, path, new)
 
 
+class MountView:
+    """
+    Recursive view of the mounts. The __enter__ method returns
+    the root as a ModelNode whose mount is trimmed off and
+    exposed as node.mounts, where the models are grouped by
+    their gvr as in the TypeView and are ModelNodes in turn,
+    e.g., mv.mounts["rooms"]["room-1"].mounts["lamps"]. The
+    levels are built lazily when accessed on a TrackedDict of
+    the root_view, and __exit__ applies the writes at all the
+    levels back to the root_view.
+    """
+
+    def __init__(self, root_view: dict):
+        self._root_view = root_view
+        self._new = None
+
+        assert "GROUP" in os.environ and "VERSION" in os.environ
+        self._gv_str = f"{os.environ['GROUP']}/{os.environ['VERSION']}"
+
+    def __enter__(self):
+        self._new = TrackedDict(self._root_view)
+        return ModelNode(self._new, self._gv_str)
+
+    def __exit__(self, typ, value, traceback):
+        for path, new in self._new.changes():
+            deep_set(self._root_view, path, new)
+
+
+class ModelNode(MutableMapping):
+    """Model in a MountView; see MountView."""
+    __slots__ = ("_spec", "_gv_str")
+
+    def __init__(self, spec: "TrackedDict", gv_str: str):
+        self._spec = spec
+        self._gv_str = gv_str
+
+    @property
+    def mounts(self) -> "_Mounts":
+        return _Mounts(self._spec.get("mount", {}), self._gv_str)
+
+    def __getitem__(self, k):
+        if k == "mount":
+            raise KeyError(k)
+        return self._spec[k]
+
+    def __setitem__(self, k, v):
+        if k == "mount":
+            raise KeyError(f"{k} is trimmed off in the mount view")
+        self._spec[k] = v
+
+    def __delitem__(self, k):
+        if k == "mount":
+            raise KeyError(k)
+        del self._spec[k]
+
+    def __iter__(self):
+        return (k for k in self._spec if k != "mount")
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {k: v.to_dict() if isinstance(v, TrackedDict) else v
+                for k, v in self.items()}
+
+
+class _Mounts(Mapping):
+    # models keyed by the (short) gvr
+    __slots__ = ("_mount", "_gv_str")
+
+    def __init__(self, mount: Mapping, gv_str: str):
+        self._mount = mount
+        self._gv_str = gv_str
+
+    def __getitem__(self, typ: str):
+        if typ not in self._mount:
+            typ = util.full_gvr(typ)
+        return _Models(self._mount[typ], self._gv_str)
+
+    def __iter__(self):
+        return (typ.replace(self._gv_str + "/", "") for typ in self._mount)
+
+    def __len__(self):
+        return len(self._mount)
+
+
+class _Models(Mapping):
+    # models with spec keyed by the (trimmed) name
+    __slots__ = ("_models", "_gv_str")
+
+    def __init__(self, models: Mapping, gv_str: str):
+        self._models = models
+        self._gv_str = gv_str
+
+    def __getitem__(self, n: str):
+        # models can be keyed without the namespace
+        m = self._models[n] if n in self._models \
+            else self._models[util.normalized_nsn(n)]
+        if "spec" not in m:
+            raise KeyError(n)
+        return ModelNode(m["spec"], self._gv_str)
+
+    def __iter__(self):
+        return (n.replace("default/", "") for n, m in self._models.items()
+                if "spec" in m)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class ColumnView:
+    """
+    Columnar view of the models of a mount type where each
+    selected attribute is a NumPy array over the models, e.g.,
+
+        with ColumnView(proc_view, "lamps",
+                        ["control.power.status"]) as cv:
+            on = cv["control.power.status"] == "on"
+            cv["control.brightness.intent"][on] = b / on.sum()
+
+    The numeric attributes are float arrays where the missing
+    values are NaN; the others are object arrays where they are
+    None. Attributes not selected are loaded on first access.
+    The __exit__ method writes the changed entries back to the
+    models' spec. Requires numpy (digi[columnar]).
+    """
+
+    def __init__(self, root_view: dict, gvr_str: str, attrs: list = ()):
+        if np is None:
+            raise ImportError("ColumnView requires numpy")
+
+        self._root_view = root_view
+        self._typ = util.full_gvr(gvr_str)
+        self._attrs = list(attrs)
+
+        # names of the models and their specs
+        self.names = None
+        self._specs = list()
+        self._cols, self._old = dict(), dict()
+        # attributes whose present values are all ints
+        self._ints = set()
+
+    def __enter__(self):
+        ms = self._root_view.get("mount", {}).get(self._typ, {})
+        names = [n for n, m in ms.items() if "spec" in m]
+        self._specs = [ms[n]["spec"] for n in names]
+        self.names = np.array([n.replace("default/", "") for n in names],
+                              dtype=object)
+
+        for attr in self._attrs:
+            _ = self[attr]
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        for attr, col in self._cols.items():
+            old = self._old[attr]
+            changed = (old != col) & ~(_missing(old) & _missing(col))
+            ints = attr in self._ints
+            for i in np.flatnonzero(changed):
+                deep_set(self._specs[i], attr, _to_py(col[i], ints),
+                         create=True)
+
+    def __len__(self):
+        return len(self._specs)
+
+    def __contains__(self, attr):
+        return attr in self._cols
+
+    def __getitem__(self, attr: str):
+        col = self._cols.get(attr, None)
+        if col is None:
+            values = [util.deep_get(s, attr) for s in self._specs]
+            col = _to_column(values)
+            self._cols[attr], self._old[attr] = col, col.copy()
+            if col.dtype.kind == "f" and all(
+                    type(v) is int for v in values if v is not None):
+                self._ints.add(attr)
+        return col
+
+    def __setitem__(self, attr: str, v):
+        # assign (broadcast) in place; the column turns into
+        # an object array if v does not fit the numeric one
+        col = self[attr]
+        try:
+            col[...] = v
+        except (TypeError, ValueError):
+            col = self._cols[attr] = col.astype(object)
+            col[...] = v
+
+
+def _to_column(values: list):
+    present = [v for v in values if v is not None]
+    if len(present) > 0 and all(isinstance(v, (int, float)) and
+                                not isinstance(v, bool) for v in present):
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype=float)
+    col = np.empty(len(values), dtype=object)
+    col[:] = values
+    return col
+
+
+def _missing(col):
+    if col.dtype.kind == "f":
+        return np.isnan(col)
+    return np.array([v is None or v != v for v in col], dtype=bool)
+
+
+def _to_py(v, ints=False):
+    # numpy scalars to python values; NaN to None; the
+    # integral values of an int attribute back to ints
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float):
+        if v != v:
+            return None
+        if ints and v.is_integer():
+            return int(v)
+    return v
+
+
+class TrackedDict(MutableMapping):
+    """
+    Copy-on-write proxy of a dict. Reads go through to the
+    source, where the nested dicts are returned as proxies
+    of the subtrees; writes go to an overlay and are logged
+    with their paths in a log shared by the proxies, s.t.
+    the changes are applied in O(writes) by replaying the
+    log (changes()) instead of a deepcopy and a diff.
+
+    Lists are copied when read and logged if they are
+    changed in place.
+    """
+    __slots__ = ("_src", "_path", "_log", "_overlay", "_children")
+
+    def __init__(self, src: dict, path: tuple = (), log: list = None):
+        self._src = src
+        self._path = path
+        # entries of form (path, value, orig), where orig is the
+        # source of a copied list or _WRITTEN for the writes
+        self._log = list() if log is None else log
+        self._overlay = dict()
+        self._children = dict()
+
+    def __getitem__(self, k):
+        if k in self._overlay:
+            v = self._overlay[k]
+            if v is _DELETED:
+                raise KeyError(k)
+            return v
+
+        child = self._children.get(k, None)
+        if child is not None:
+            return child
+
+        v = self._src[k]
+        if isinstance(v, dict):
+            child = TrackedDict(v, self._path + (k,), self._log)
+            self._children[k] = child
+            return child
+        if isinstance(v, list):
+            self._overlay[k] = copy.deepcopy(v)
+            self._log.append((self._path + (k,), self._overlay[k], v))
+            return self._overlay[k]
+        return v
+
+    def __setitem__(self, k, v):
+        if isinstance(v, TrackedDict):
+            v = v.to_dict()
+        self._overlay[k] = v
+        self._children.pop(k, None)
+        self._log.append((self._path + (k,), v, _WRITTEN))
+
+    def __delitem__(self, k):
+        if k not in self:
+            raise KeyError(k)
+        self._overlay[k] = _DELETED
+        self._children.pop(k, None)
+        self._log.append((self._path + (k,), None, _WRITTEN))
+
+    def __contains__(self, k):
+        if k in self._overlay:
+            return self._overlay[k] is not _DELETED
+        return k in self._src
+
+    def __iter__(self):
+        for k in self._src:
+            if self._overlay.get(k, None) is not _DELETED:
+                yield k
+        for k, v in self._overlay.items():
+            if k not in self._src and v is not _DELETED:
+                yield k
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self) -> dict:
+        """Materialize the view as a dict."""
+        d = dict()
+        for k in self:
+            v = self[k]
+            d[k] = v.to_dict() if isinstance(v, TrackedDict) else v
+        return d
+
+    def changes(self) -> list:
+        """Written (path, value) in order; the deleted
+        attributes are set to None."""
+        return [(path, v) for path, v, orig in self._log
+                if orig is _WRITTEN or v != orig]
+
+
+_WRITTEN, _DELETED = object(), object()
+
+
+def _paths_of(projection: dict, typ: str):
+    # attribute paths of the gvr (or "root") in the projection;
+    # the gvrs can be short (plural only) or "*" for all types
+    for k, paths in projection.items():
+        if k == typ or k == "*" and typ != "root" or \
+                typ != "root" and k != "root" and util.gvr_equal(k, typ):
+            return paths
+    return None
+
+
+def _project_model(spec: dict, name: str, projection: dict,
+                   typ: str = "root") -> dict:
+    if projection is None:
+        return {name: spec}
+    paths = _paths_of(projection, typ)
+    if paths is None:
+        return {}
+    return {name: _project(spec, paths)}
+
+
+def _project(d: dict, paths: list) -> dict:
+    """
+    Projection of d to the attribute paths, e.g., ["control.
+    power", "obs.*.time"], where "*" matches any attribute
+    and "." the whole d. The projection is a trimmed copy of
+    the dicts along the paths whose leaves are the subtrees
+    of d themselves, so only the projected subtrees are built
+    and the writes to them go to d.
+    """
+    proj = dict()
+    for p in paths:
+        if p in {".", ""}:
+            return d
+        _project_path(d, p.split(".") if isinstance(p, str) else p, proj)
+    return proj
+
+
+def _project_path(src: dict, path: list, dst: dict):
+    k, rest = path[0], path[1:]
+    for k in (list(src) if k == "*" else [k] if k in src else []):
+        v = src[k]
+        if len(rest) == 0:
+            dst[k] = v
+        elif isinstance(v, Mapping) and dst.get(k, None) is not v:
+            _project_path(v, rest, dst.setdefault(k, {}))
+
+
+def _set_root(root: dict, path: tuple, val):
+    if len(path) == 0:
+        # the whole root is written
+        root.clear()
+        root.update(val or {})
+        return
+    deep_set(root, path, val)
+
+
 class DotView:
-    """Dot accessible models."""
+    """
+    Dot accessible models. The attributes are looked up
+    lazily in the source view, where the keys are accessed
+    by their safe names, i.e., with the characters in the
+    _char_map replaced, and the writes go straight through
+    to the source view.
+    """
     _char_map = {
         "-": "_",
         ".": "_",
@@ -137,42 +540,112 @@ class DotView:
 
     def __init__(self, src_view):
         self._src_view = src_view
-        self._dot_view = None
-        self._dot_view_old = None
-        # map between unsafe attributes
-        # to original ones
-        self._attr_map = dict()
 
     def __enter__(self):
-        # box does not record nor expose a conversion
-        # map for the safe attributes, so we do so
-        # ahead of time and pass a safe dict to box;
-        # the self._attr_map keeps track of any conversion.
-        self._dot_view_old = self._to_safe_dict(self._src_view)
-        self._dot_view = Box(self._dot_view_old)
-        return self._dot_view
+        return DotDict(self._src_view)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        _src = self._src_view
-        self._dot_view = self._dot_view.to_dict()
-        _diffs = diff(self._dot_view_old, self._dot_view)
-        for op, path, old, new in _diffs:
-            path = [self._attr_map.get(p, p) for p in path]
-            deep_set(_src, path, new)
-
-    def _to_safe_dict(self, d: dict) -> dict:
-        safe_d = dict()
-        for k, v in d.items():
-            orig_k = k
-            k = self._to_safe_attr(k)
-            self._attr_map[k] = orig_k
-            if isinstance(v, dict):
-                v = self._to_safe_dict(v)
-            safe_d[k] = v
-        return safe_d
+        pass
 
     @staticmethod
     def _to_safe_attr(s: str):
         for k, v in DotView._char_map.items():
             s = s.replace(k, v)
         return s
+
+
+class DotDict(MutableMapping):
+    """Dot accessible proxy of a mapping; see DotView."""
+    __slots__ = ("_src",)
+
+    def __init__(self, src: Mapping):
+        object.__setattr__(self, "_src", src)
+
+    def __getattr__(self, k):
+        try:
+            return self[k]
+        except KeyError:
+            raise AttributeError(k)
+
+    def __setattr__(self, k, v):
+        self[k] = v
+
+    def __delattr__(self, k):
+        try:
+            del self[k]
+        except KeyError:
+            raise AttributeError(k)
+
+    def __getitem__(self, k):
+        return _to_dot(self._src[self._key(k)])
+
+    def __setitem__(self, k, v):
+        self._src[self._key(k)] = _from_dot(v)
+
+    def __delitem__(self, k):
+        del self._src[self._key(k)]
+
+    def __contains__(self, k):
+        return self._key(k) in self._src
+
+    def __iter__(self):
+        for k in self._src:
+            yield DotView._to_safe_attr(k) if isinstance(k, str) else k
+
+    def __len__(self):
+        return len(self._src)
+
+    def __repr__(self):
+        return f"DotDict({self._src!r})"
+
+    def _key(self, k):
+        # the source key of a safe name
+        src = self._src
+        if k in src:
+            return k
+        for _k in src:
+            if isinstance(_k, str) and DotView._to_safe_attr(_k) == k:
+                return _k
+        return k
+
+
+class DotList(MutableSequence):
+    """Proxy of a list whose items are dot accessible."""
+    __slots__ = ("_src",)
+
+    def __init__(self, src: list):
+        self._src = src
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [_to_dot(v) for v in self._src[i]]
+        return _to_dot(self._src[i])
+
+    def __setitem__(self, i, v):
+        self._src[i] = _from_dot(v)
+
+    def __delitem__(self, i):
+        del self._src[i]
+
+    def __len__(self):
+        return len(self._src)
+
+    def __repr__(self):
+        return f"DotList({self._src!r})"
+
+    def insert(self, i, v):
+        self._src.insert(i, _from_dot(v))
+
+
+def _to_dot(v):
+    if isinstance(v, Mapping):
+        return DotDict(v)
+    if isinstance(v, list):
+        return DotList(v)
+    return v
+
+
+def _from_dot(v):
+    if isinstance(v, (DotDict, DotList)):
+        return v._src
+    return v
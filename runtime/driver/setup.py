@@ -21,6 +21,8 @@ setup(
         "pyyaml",
         "pyjq",
         "inflection",
-        "python-box",
     ],
+    extras_require={
+        "columnar": ["numpy"],
+    },
 )